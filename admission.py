@@ -0,0 +1,206 @@
+"""
+Admission control for model work.
+
+Every request that needs the model is admitted here first. Once the amount
+of outstanding work reaches a maximum depth, or the estimated time to work
+through it exceeds the maximum queue wait, new requests are rejected right
+away with a Retry-After estimate instead of queueing until the client
+times out. The estimate is based on the throughput of recently completed
+requests, measured over the time the model actually had work so that idle
+periods don't make it look slower than it is.
+
+Bulk requests count for several units of work, but never for more than a
+share of the maximum depth, so they still fit next to ordinary traffic
+instead of waiting forever for the queue to drain completely.
+"""
+
+import collections
+import math
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot be admitted.
+
+    Args:
+        retry_after (int): Suggested number of seconds before retrying
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server is overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds outstanding model work by queue depth and estimated queue wait.
+
+    Args:
+        max_depth (int): Maximum number of outstanding work units. 0 disables admission control
+        max_queue_wait_ms (float): Reject new work when the estimated wait before it
+            would start exceeds this. 0 disables the wait check
+        window (int): Number of recent completions used to estimate throughput
+        max_request_units (int): Most units a single request counts for. Defaults to
+            half of max_depth
+    """
+
+    def __init__(self, max_depth=64, max_queue_wait_ms=10000, window=100, max_request_units=None):
+        self.max_depth = max(0, int(max_depth))
+        if max_request_units is None:
+            max_request_units = self.max_depth // 2
+        self.max_request_units = max(1, int(max_request_units))
+        self.max_queue_wait = max(0.0, float(max_queue_wait_ms)) / 1000.0
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._completions = collections.deque(maxlen=window)
+        self.admitted = 0
+        self.rejected = 0
+
+        # Seconds during which there was outstanding work, and when that was last updated
+        self._busy_clock = 0.0
+        self._busy_mark = time.monotonic()
+
+    def _tick(self, now):
+        """Advance the busy clock up to now. The caller must hold the lock."""
+        if self._outstanding:
+            self._busy_clock += now - self._busy_mark
+        self._busy_mark = now
+
+    def _throughput(self):
+        """
+        Estimate completed work units per busy second. The caller must hold the lock.
+
+        Returns:
+            float: Recent throughput, or None if there is not enough history
+        """
+        if len(self._completions) < 2:
+            # Fall back to the service time of the single completion we know about
+            if self._completions:
+                _, units, service_time = self._completions[0]
+                return units / service_time if service_time > 0 else None
+            return None
+        elapsed = self._busy_clock - self._completions[0][0]
+        units = sum(units for _, units, _ in list(self._completions)[1:])
+        return units / elapsed if elapsed > 0 else None
+
+    def _units(self, units):
+        """Units a request counts for, capped at max_request_units while admission control is on."""
+        return min(units, self.max_request_units) if self.max_depth else units
+
+    def admit(self, units=1):
+        """
+        Admit work or reject it.
+
+        Args:
+            units (int): Amount of work the request adds to the queue
+
+        Returns:
+            float: Admission timestamp, to be passed to release()
+
+        Raises:
+            Overloaded: If the queue is full or the estimated wait is too long
+        """
+        units = self._units(units)
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            if self.max_depth and self._outstanding:
+                throughput = self._throughput()
+                estimated_wait = self._outstanding / throughput if throughput else 0.0
+                too_deep = self._outstanding + units > self.max_depth
+                too_slow = self.max_queue_wait and estimated_wait > self.max_queue_wait
+                if too_deep or too_slow:
+                    self.rejected += 1
+                    # Time until enough queued work has drained for this request to fit
+                    excess = max(self._outstanding + units - self.max_depth, 1)
+                    retry_after = excess / throughput if throughput else 1.0
+                    if too_slow:
+                        retry_after = max(retry_after, estimated_wait - self.max_queue_wait)
+                    raise Overloaded(max(1, math.ceil(retry_after)))
+            self._outstanding += units
+            self.admitted += 1
+        return now
+
+    def release(self, admitted_at, units=1):
+        """
+        Record that admitted work has finished.
+
+        Args:
+            admitted_at (float): Timestamp returned by admit()
+            units (int): The units passed to admit()
+        """
+        units = self._units(units)
+        now = time.monotonic()
+        with self._lock:
+            self._tick(now)
+            self._outstanding -= units
+            self._completions.append((self._busy_clock, units, now - admitted_at))
+
+    def guard(self, start, units=1):
+        """
+        Admit work, start it, and release it once its future completes.
+
+        Args:
+            start (callable): Starts the work and returns a Future
+            units (int): Amount of work the request adds to the queue
+
+        Returns:
+            Future: The future returned by start
+
+        Raises:
+            Overloaded: If the work cannot be admitted
+        """
+        admitted_at = self.admit(units)
+        try:
+            future = start()
+        except BaseException:
+            self.release(admitted_at, units)
+            raise
+        future.add_done_callback(lambda _: self.release(admitted_at, units))
+        return future
+
+    def hold(self, units=1):
+        """
+        Admit work whose end is not marked by a Future, e.g. a response stream.
+
+        The returned release function may be called from every place the work can end;
+        only the first call releases it.
+
+        Args:
+            units (int): Amount of work the request adds to the queue
+
+        Returns:
+            callable: Releases the admitted work
+
+        Raises:
+            Overloaded: If the work cannot be admitted
+        """
+        admitted_at = self.admit(units)
+        lock = threading.Lock()
+        pending = [True]
+
+        def release():
+            with lock:
+                if not pending:
+                    return
+                pending.clear()
+            self.release(admitted_at, units)
+
+        return release
+
+    def stats(self):
+        """
+        Returns:
+            dict: Outstanding work, admitted and rejected counts, and recent throughput
+        """
+        with self._lock:
+            self._tick(time.monotonic())
+            throughput = self._throughput()
+            return {
+                "outstanding": self._outstanding,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "throughput_per_s": round(throughput, 3) if throughput else None,
+            }
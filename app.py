@@ -1,43 +1,617 @@
-from fastapi import FastAPI
-from transformers import pipeline
+# Import the array module to encode embeddings as packed float32 values
+import array
 
-app = FastAPI()
+# Import the math module for rounding chunk counts
+import math
 
-pipe = pipeline("text2text-generation", model="google/flan-t5-small")
+# Import the os module to read configuration from environment variables
+import os
 
-@app.get("/")
-def home():
-    return {"message": "Welcome to the Text Generation API!"}
+# Import the sys module to check the platform's byte order for binary embeddings
+import sys
 
-@app.get('/generate')
-def generate(text:str):
-    output = pipe(text)
-    return {"output":output[0]['generated_text']}# Import the FastAPI framework
+# Import the time module to track how much of a request's deadline is left
+import time
+
+# Import the weakref module to release a stream's admission slot if its body is never iterated
+import weakref
+
+# Import typing helpers for the request body models
+from typing import Annotated, List, Literal, Optional, Union
+
+# Import the FastAPI framework
 # FastAPI is a modern, high-performance web framework for building APIs with Python
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+
+# Import run_in_threadpool to keep blocking disk cache reads off the event loop
+from fastapi.concurrency import run_in_threadpool
+
+# Import StreamingResponse to send Server-Sent Events as they are produced
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Import BackgroundTask to run cleanup once a streamed response has been sent
+from starlette.background import BackgroundTask
+
+# Import Pydantic to describe and validate JSON request bodies
+from pydantic import BaseModel, Field
+
+# Import StoppingCriteriaList from transformers, which carries per-request deadlines
+# into generate() so decoding stops once they expire
+from transformers import StoppingCriteriaList
+
+# Import the loader for the selected inference backend (PyTorch, ONNX Runtime or CTranslate2)
+from backends import load_pipeline
+
+# Import the micro-batching scheduler that groups concurrent requests
+from batching import MicroBatcher
+
+# Import the continuous batching scheduler that batches individual decoder steps
+from continuous import ContinuousBatcher
+
+# Import the bounded executor that runs all model calls
+from executor import InferenceExecutor
+
+# Import the token streaming helper used by /generate/stream
+from streaming import stream_generate
+
+# Import generation of several scored candidates per prompt
+from candidates import generate_candidates
+
+# Import the in-memory response cache
+from cache import DiskCache, ResponseCache, cache_key, is_deterministic
+
+# Import the semantic cache, which answers paraphrases of prompts seen before
+from semantic_cache import SemanticCache
+
+# Import the de-duplication of identical in-flight requests
+from singleflight import SingleFlight
+
+# Import admission control, which rejects work when the model is saturated
+from admission import AdmissionController, Overloaded
+
+# Import per-request deadlines, which stop generation once nobody is waiting for it
+from deadlines import Deadline, DeadlineCriteria, DeadlineExceeded, wait_for_result
+
+# Import dynamic int8 quantization for faster CPU inference
+from quantization import quantize_dynamic_int8
+
+# Import the lean generation engine that can replace the generic pipeline
+from engine import GenerationEngine
+
+# Import torch.compile mode, which removes per-operation Python overhead from decoding
+from compiled import compile_model
 
-# Import the pipeline module from transformers
-# Hugging Face's transformers library provides easy-to-use interfaces for working with
-# state-of-the-art NLP models
-from transformers import pipeline
+# Import the cache of encoder outputs, reused when an input is sent again with other parameters
+from encoder_cache import EncoderCache
+
+# Import the splitting of long inputs into chunks that fit the model
+from chunking import chunk_text, split_instruction
+
+# Import sentence splitting for translating long texts one sentence at a time
+from translation import has_paragraphs, is_translation, join_sentences, split_sentences
+
+# Configuration
+# All settings can be overridden with environment variables, e.g. in the Dockerfile
+# or in the Hugging Face Space settings
+# - MODEL_ID: Hugging Face Hub id (or local path) of the model to serve
+# - MODEL_QUANTIZATION: Set to "int8" to serve a dynamically quantized model on CPU
+#   (see benchmarks/quantization_report.py for its speed and output agreement)
+# - GENERATION_ENGINE: "pipeline" (default) to generate with the transformers pipeline, or
+#   "lean" to drive the PyTorch model with the app's own decoding loop, which has less
+#   per-request overhead (see benchmarks/engine_benchmark.py)
+# - PROMPT_LOOKUP_TOKENS: With the lean engine, the maximum number of tokens copied from
+#   the prompt as a draft and verified in one decoder forward during greedy decoding of a
+#   single prompt; speeds up copy-heavy tasks without changing outputs (0 disables it;
+#   not supported with BATCHING_MODE=continuous; see benchmarks/speculative_benchmark.py)
+# - PROMPT_LOOKUP_NGRAM: Longest run of generated tokens looked up in the prompt for a draft
+# - MODEL_COMPILE: Set to "1" to run the PyTorch model through torch.compile; every
+#   length bucket is compiled at startup (see benchmarks/compile_report.py)
+# - COMPILE_LENGTH_BUCKETS: Comma-separated input lengths, in tokens, the compiled encoder
+#   is specialized for; inputs are padded to the next one and longer inputs run eagerly
+# - ENCODER_CACHE_MAX_BYTES: Maximum total size of the encoder outputs kept for inputs sent
+#   again with different generation parameters (PyTorch only; 0 disables it)
+# - INFERENCE_BACKEND: "pytorch" (default), "onnx" to run the model with ONNX Runtime, or
+#   "ctranslate2" to run an int8 CTranslate2 conversion of it
+#   (see benchmarks/backend_benchmark.py for the latency difference)
+# - BACKEND_CACHE_DIR: Where converted models (e.g. the ONNX export) are kept between runs
+# - BATCHING_MODE: "static" (default) to run each /generate micro-batch to completion, or
+#   "continuous" to decode one step at a time, adding new prompts and retiring finished
+#   ones between steps (PyTorch only; see benchmarks/continuous_benchmark.py)
+# - CONTINUOUS_MAX_ACTIVE: Maximum number of prompts decoded together in continuous mode
+# - BATCH_MAX_SIZE: Maximum number of prompts run through the model in one batch
+# - BATCH_MAX_WAIT_MS: How long a request may wait for others to join its batch
+# - BATCH_BUCKET_EDGES: Comma-separated token-length bucket bounds; prompts are only
+#   batched with others in the same bucket to limit padding
+# - INFERENCE_WORKERS: Number of model calls allowed to run at the same time
+# - TORCH_THREADS: CPU threads PyTorch may use in total, split evenly between the
+#   inference workers (defaults to the number of CPUs)
+# - GENERATE_MAX_CANDIDATES: Maximum number of candidates /generate returns for one prompt
+#   (num_return_sequences)
+# - GENERATE_MAX_CHOICES: Maximum number of allowed outputs (choices) in one /generate request
+# - SCORE_MAX_CANDIDATES: Maximum number of candidate outputs in one POST /score request
+# - EMBED_MAX_TEXTS: Maximum number of texts in one POST /embed request
+# - GENERATE_BATCH_CHUNK_SIZE: Prompts per model call for POST /generate/batch
+# - GENERATE_BATCH_MAX_PROMPTS: Maximum number of prompts accepted in one batch request
+# - LONG_INPUT_CHUNK_TOKENS: Tokens per chunk, including the repeated instruction, when
+#   /generate splits a long input (long_input=map or map_reduce); flan-t5 is trained on up to 512
+# - LONG_INPUT_OVERLAP_TOKENS: Tokens shared by consecutive chunks of a long input
+# - LONG_INPUT_MAX_CHUNKS: Maximum number of chunks one long input may be split into
+# - TRANSLATION_SENTENCE_SPLIT: Set to "0" to stop /generate from translating long texts
+#   ("Translate to German: ...") one sentence per prompt, as one batch
+# - TRANSLATION_SPLIT_MIN_TOKENS: Texts to translate are split into sentences when they have
+#   paragraph breaks or more tokens than this; shorter ones are translated in one pass
+# - TRANSLATION_MAX_SENTENCES: Maximum number of sentences in one split translation
+# - CACHE_MAX_ENTRIES: Maximum number of responses kept in the in-memory cache (0 disables it)
+# - CACHE_MAX_BYTES: Maximum total size of the cached prompts and responses
+# - CACHE_DB_PATH: Optional SQLite file for a persistent cache that survives restarts,
+#   e.g. /data/cache.sqlite on a Hugging Face Space with persistent storage
+# - CACHE_DB_MAX_BYTES: Maximum total size of the responses kept on disk
+# - SEMANTIC_CACHE_THRESHOLD: Minimum cosine similarity between the encoder embeddings of a
+#   new prompt and a cached one for the cached output to be reused, e.g. 0.97 (PyTorch only;
+#   0 disables the semantic cache)
+# - SEMANTIC_CACHE_MAX_ENTRIES: Maximum number of prompts kept in the semantic cache
+# - ADMISSION_MAX_DEPTH: Maximum number of requests waiting for or using the model
+#   before new ones are rejected with 429 (0 disables admission control); a bulk request
+#   counts for one per chunk, but for at most half of this
+# - ADMISSION_MAX_QUEUE_WAIT_MS: Reject new requests when the estimated wait before
+#   they would start exceeds this
+# - REQUEST_TIMEOUT_MS: Default deadline for model requests; clients may ask for less
+#   with the timeout_ms query parameter or the X-Timeout-Ms header (0 means no default)
+MODEL_ID = os.getenv("MODEL_ID", "google/flan-t5-small")
+MODEL_QUANTIZATION = os.getenv("MODEL_QUANTIZATION", "").lower()
+GENERATION_ENGINE = os.getenv("GENERATION_ENGINE", "pipeline").lower()
+PROMPT_LOOKUP_TOKENS = int(os.getenv("PROMPT_LOOKUP_TOKENS", "0"))
+PROMPT_LOOKUP_NGRAM = int(os.getenv("PROMPT_LOOKUP_NGRAM", "3"))
+MODEL_COMPILE = os.getenv("MODEL_COMPILE", "").lower() in ("1", "true", "yes")
+COMPILE_LENGTH_BUCKETS = [int(length) for length in os.getenv("COMPILE_LENGTH_BUCKETS", "32,64,128,256,512").split(",") if length.strip()]
+ENCODER_CACHE_MAX_BYTES = int(os.getenv("ENCODER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch").lower()
+BACKEND_CACHE_DIR = os.getenv("BACKEND_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "text-generation-api"))
+BATCHING_MODE = os.getenv("BATCHING_MODE", "static").lower()
+CONTINUOUS_MAX_ACTIVE = int(os.getenv("CONTINUOUS_MAX_ACTIVE", "16"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+BATCH_BUCKET_EDGES = [int(edge) for edge in os.getenv("BATCH_BUCKET_EDGES", "16,32,64,128,256").split(",") if edge.strip()]
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0")) or os.cpu_count()
+GENERATE_MAX_CANDIDATES = int(os.getenv("GENERATE_MAX_CANDIDATES", "8"))
+GENERATE_MAX_CHOICES = int(os.getenv("GENERATE_MAX_CHOICES", "100"))
+SCORE_MAX_CANDIDATES = int(os.getenv("SCORE_MAX_CANDIDATES", "100"))
+EMBED_MAX_TEXTS = int(os.getenv("EMBED_MAX_TEXTS", "256"))
+GENERATE_BATCH_CHUNK_SIZE = int(os.getenv("GENERATE_BATCH_CHUNK_SIZE", "16"))
+GENERATE_BATCH_MAX_PROMPTS = int(os.getenv("GENERATE_BATCH_MAX_PROMPTS", "1024"))
+LONG_INPUT_CHUNK_TOKENS = int(os.getenv("LONG_INPUT_CHUNK_TOKENS", "512"))
+LONG_INPUT_OVERLAP_TOKENS = int(os.getenv("LONG_INPUT_OVERLAP_TOKENS", "32"))
+LONG_INPUT_MAX_CHUNKS = int(os.getenv("LONG_INPUT_MAX_CHUNKS", "64"))
+TRANSLATION_SENTENCE_SPLIT = os.getenv("TRANSLATION_SENTENCE_SPLIT", "1").lower() in ("1", "true", "yes")
+TRANSLATION_SPLIT_MIN_TOKENS = int(os.getenv("TRANSLATION_SPLIT_MIN_TOKENS", "384"))
+TRANSLATION_MAX_SENTENCES = int(os.getenv("TRANSLATION_MAX_SENTENCES", "256"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+CACHE_DB_MAX_BYTES = int(os.getenv("CACHE_DB_MAX_BYTES", str(256 * 1024 * 1024)))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000"))
+ADMISSION_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_DEPTH", "64"))
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_MS", "10000"))
+REQUEST_TIMEOUT_MS = float(os.getenv("REQUEST_TIMEOUT_MS", "30000"))
 
 # Initialize the FastAPI application
 # This creates the main entry point for our API
 app = FastAPI()
 
+# Set up the inference executor
+# All model calls run on a fixed number of worker threads with a matching PyTorch
+# thread budget, so under load requests wait in a queue instead of fighting over cores
+executor = InferenceExecutor(workers=INFERENCE_WORKERS, total_threads=TORCH_THREADS)
+
 # Set up the text generation pipeline
 # Parameters:
 # - "text2text-generation": Task type - converts input text to output text
 # - model: "google/flan-t5-small" - A 80M parameter instruction-tuned T5 model
 #   FLAN-T5 models are fine-tuned on a variety of instruction-based tasks
 #   and can follow natural language instructions
-# 
+# - backend: eager PyTorch, the model exported to ONNX and run with ONNX Runtime,
+#   or the model converted to CTranslate2
+#
 # This pipeline handles:
 # 1. Loading the model from Hugging Face Hub (first run will download it)
 # 2. Setting up the tokenizer appropriate for this model
 # 3. Managing the device placement (CPU/GPU)
 # 4. Pre/post-processing for inputs/outputs
-pipe = pipeline("text2text-generation", model="google/flan-t5-small")
+pipe = load_pipeline(
+    INFERENCE_BACKEND,
+    MODEL_ID,
+    BACKEND_CACHE_DIR,
+    threads=executor.threads_per_worker,
+    workers=executor.workers,
+)
+
+# Optionally quantize the model's Linear layers to int8 before serving
+# Quantization applies to the PyTorch model only
+if MODEL_QUANTIZATION == "int8" and INFERENCE_BACKEND == "pytorch":
+    pipe.model = quantize_dynamic_int8(pipe.model)
+elif MODEL_QUANTIZATION:
+    raise ValueError(f"Unsupported MODEL_QUANTIZATION: {MODEL_QUANTIZATION!r} for the {INFERENCE_BACKEND} backend")
+
+# Optionally replace the pipeline with the lean generation engine
+# It is called exactly like the pipeline, so everything below works with either
+if GENERATION_ENGINE == "lean" and INFERENCE_BACKEND == "pytorch":
+    pipe = GenerationEngine(pipe.model, pipe.tokenizer, lookup_tokens=PROMPT_LOOKUP_TOKENS, lookup_ngram=PROMPT_LOOKUP_NGRAM)
+elif GENERATION_ENGINE != "pipeline":
+    raise ValueError(f"Unsupported GENERATION_ENGINE: {GENERATION_ENGINE!r} for the {INFERENCE_BACKEND} backend")
+elif PROMPT_LOOKUP_TOKENS:
+    raise ValueError("PROMPT_LOOKUP_TOKENS requires GENERATION_ENGINE=lean")
+
+# Optionally compile the PyTorch model
+# Compilation happens here, before the app accepts requests, so startup takes longer
+# but no request waits for a graph to be built
+compile_stats = None
+if MODEL_COMPILE:
+    if INFERENCE_BACKEND != "pytorch":
+        raise ValueError(f"MODEL_COMPILE is not supported for the {INFERENCE_BACKEND} backend")
+    if PROMPT_LOOKUP_TOKENS:
+        raise ValueError("MODEL_COMPILE is not supported with PROMPT_LOOKUP_TOKENS")
+    # Warm up through whatever serves requests, so the graphs it needs are the ones compiled
+    warmup = pipe.generate if GENERATION_ENGINE == "lean" else None
+    compile_stats = compile_model(pipe.model, COMPILE_LENGTH_BUCKETS, generate=warmup)
+
+# Set up the encoder output cache
+# The encoder only sees the input, so a prompt sent again with other max_new_tokens,
+# beams or sampling settings reuses its hidden states and only runs the decoder.
+# It wraps the (possibly compiled) encoder, so every generation path goes through it
+encoder_cache = None
+if ENCODER_CACHE_MAX_BYTES and INFERENCE_BACKEND == "pytorch":
+    encoder_cache = EncoderCache(pipe.model.encoder, max_bytes=ENCODER_CACHE_MAX_BYTES)
+    pipe.model.encoder = encoder_cache
+
+# The lean engine also drives the PyTorch model directly for the features the pipeline
+# has no equivalent for (continuous batching, restricted choices, scoring, embeddings); it shares
+# the pipeline's model
+engine = None
+if INFERENCE_BACKEND == "pytorch":
+    engine = pipe if isinstance(pipe, GenerationEngine) else GenerationEngine(pipe.model, pipe.tokenizer)
+
+
+def run_pipeline_batch(texts, deadlines=None, **generate_kwargs):
+    """
+    Run a list of prompts through the pipeline as a single padded batch.
+
+    Args:
+        texts (list): The input prompts
+        deadlines (list): Optional Deadline per prompt; a prompt stops decoding
+            once its deadline expires
+        **generate_kwargs: Generation parameters shared by every prompt
+
+    Returns:
+        list: The generated text for each prompt, in the same order
+    """
+    if deadlines and any(deadline is not None for deadline in deadlines):
+        criteria = DeadlineCriteria(deadlines)
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+    outputs = pipe(texts, batch_size=len(texts), **generate_kwargs)
+    return [output['generated_text'] for output in outputs]
+
+
+def token_length(text):
+    """
+    Count the tokens the pipeline's tokenizer produces for a prompt.
+
+    Args:
+        text (str): The input prompt
+
+    Returns:
+        int: Number of input tokens, including special tokens
+    """
+    return len(pipe.tokenizer(text)['input_ids'])
+
+
+def token_lengths(texts):
+    """
+    Count the tokens of many prompts in one batched tokenizer call.
+
+    Args:
+        texts (list): The input prompts
+
+    Returns:
+        list: Number of input tokens of each prompt, including special tokens
+    """
+    return [len(ids) for ids in pipe.tokenizer(list(texts))['input_ids']] if texts else []
+
+
+# Set up the batcher for /generate
+# Static: concurrent /generate calls are queued and run through the pipeline together,
+# so N simultaneous requests cost one batched forward pass instead of N.
+# Prompts are grouped by token length so short ones are not padded to long ones.
+# Continuous: prompts join and leave a running batch between decoder steps, so a short
+# answer is returned as soon as it is done instead of waiting for its batch
+if BATCHING_MODE == "continuous" and INFERENCE_BACKEND == "pytorch":
+    if MODEL_COMPILE:
+        raise ValueError("MODEL_COMPILE is not supported with BATCHING_MODE=continuous")
+    # Continuous batching drives the engine's decoder steps itself, so prompt lookup would never run
+    if PROMPT_LOOKUP_TOKENS:
+        raise ValueError("PROMPT_LOOKUP_TOKENS is not supported with BATCHING_MODE=continuous")
+    batcher = ContinuousBatcher(engine, run_pipeline_batch, max_active=CONTINUOUS_MAX_ACTIVE, executor=executor)
+elif BATCHING_MODE == "static":
+    batcher = MicroBatcher(
+        run_pipeline_batch,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        token_length=token_length,
+        bucket_edges=BATCH_BUCKET_EDGES,
+        executor=executor,
+    )
+else:
+    raise ValueError(f"Unsupported BATCHING_MODE: {BATCHING_MODE!r} for the {INFERENCE_BACKEND} backend")
+
+def run_embed_batch(texts, deadlines=None, normalize=False):
+    """
+    Embed a list of texts with the encoder as a single padded batch.
+
+    Args:
+        texts (list): The texts
+        deadlines (list): Unused; embedding is a single forward pass
+        normalize (bool): Scale every vector to unit length
+
+    Returns:
+        list: One list of floats per text, in the same order
+    """
+    return engine.embed(texts, normalize=normalize).tolist()
+
+
+# Set up the embedding micro-batcher
+# Texts from concurrent /embed requests are batched by token length like /generate prompts,
+# and run on the same inference executor, so embeddings and generation share the model
+embed_batcher = None
+if engine is not None:
+    embed_batcher = MicroBatcher(
+        run_embed_batch,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        token_length=token_length,
+        bucket_edges=BATCH_BUCKET_EDGES,
+        executor=executor,
+    )
+
+# Set up the response cache
+# Greedy decoding is deterministic, so repeated prompts with the same parameters
+# are answered from memory without tokenizing or running the model.
+# With CACHE_DB_PATH set, responses are also kept on disk and survive restarts.
+# Other backends and quantized models produce different outputs for the same prompt,
+# so they are stored apart from the plain PyTorch model's
+cache_model_id = "|".join(
+    [MODEL_ID] + ([INFERENCE_BACKEND] if INFERENCE_BACKEND != "pytorch" else []) + ([MODEL_QUANTIZATION] if MODEL_QUANTIZATION else [])
+)
+disk_cache = DiskCache(CACHE_DB_PATH, cache_model_id, max_bytes=CACHE_DB_MAX_BYTES) if CACHE_DB_PATH else None
+response_cache = ResponseCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, disk=disk_cache)
+
+# Set up the semantic cache
+# Prompts that miss the exact cache are embedded with the encoder; a paraphrase of a cached
+# prompt with the same parameters gets its output. The embedding's encoder pass is kept by
+# the encoder cache, so a prompt that misses doesn't pay for it twice
+semantic_cache = None
+if SEMANTIC_CACHE_THRESHOLD:
+    if embed_batcher is None:
+        raise ValueError(f"SEMANTIC_CACHE_THRESHOLD is not supported for the {INFERENCE_BACKEND} backend")
+    semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES)
+
+# Set up request coalescing
+# Identical deterministic requests that arrive while the first is still running
+# share its result instead of each running the model
+in_flight = SingleFlight()
+
+# Set up admission control
+# Work beyond the queue bounds is rejected immediately with 429 and a Retry-After
+# estimate, instead of queueing invisibly until clients time out
+admission = AdmissionController(max_depth=ADMISSION_MAX_DEPTH, max_queue_wait_ms=ADMISSION_MAX_QUEUE_WAIT_MS)
+
+
+# Turn admission rejections into 429 Too Many Requests responses
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+# Turn expired deadlines into 504 Gateway Timeout responses
+@app.exception_handler(DeadlineExceeded)
+async def deadline_handler(request, exc):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+def request_timeout(
+    timeout_ms: Annotated[Optional[float], Query(gt=0)] = None,
+    x_timeout_ms: Annotated[Optional[float], Header(gt=0)] = None,
+):
+    """
+    Work out how long a request may take, from the client's wishes and the server default.
+
+    Args:
+        timeout_ms (float): Deadline requested with the timeout_ms query parameter
+        x_timeout_ms (float): Deadline requested with the X-Timeout-Ms header
+
+    Returns:
+        float: The tightest of the deadlines, in seconds, or None if there is none
+    """
+    candidates = [value for value in (timeout_ms, x_timeout_ms, REQUEST_TIMEOUT_MS) if value]
+    return min(candidates) / 1000.0 if candidates else None
+
+
+async def cached_output(key):
+    """
+    Look up a response in the response cache.
+
+    A miss in memory falls through to the disk tier, whose SQLite read could stall
+    every request if it ran on the event loop, so with one configured the lookup
+    runs on the threadpool.
+
+    Args:
+        key (tuple): Key from cache_key()
+
+    Returns:
+        str: The cached output, or None on a miss
+    """
+    if disk_cache is None:
+        return response_cache.get(key)
+    return await run_in_threadpool(response_cache.get, key)
+
+
+async def cached_outputs(keys):
+    """
+    Look up many responses in the response cache, with one threadpool call for all
+    of them when a disk tier is configured.
+
+    Args:
+        keys (list): Keys from cache_key(), or None for prompts that aren't cached
+
+    Returns:
+        list: The cached output for each key, or None on a miss
+    """
+    def lookup():
+        return [response_cache.get(key) if key else None for key in keys]
+
+    if disk_cache is None:
+        return lookup()
+    return await run_in_threadpool(lookup)
+
+
+async def generate_all(prompts, deadline, timeout, is_disconnected):
+    """
+    Generate text for many prompts as batched model calls on the inference executor.
+
+    Deterministic prompts answered before come from the response cache. The rest
+    are grouped by generation parameters, sorted by length and run through the
+    pipeline in chunks of GENERATE_BATCH_CHUNK_SIZE, spread over the inference
+    workers, and their outputs are cached. Each chunk counts as one unit of
+    admitted work, up to the admission controller's per-request cap.
+
+    Args:
+        prompts (list): (text, generation parameters) per prompt
+        deadline (Deadline): Deadline shared by all prompts
+        timeout (float): Seconds the client is willing to wait for all outputs
+        is_disconnected: Coroutine function telling whether the client went away
+
+    Returns:
+        list: The generated text for each prompt, in the same order
+
+    Raises:
+        Overloaded: If admission control rejects the work
+        DeadlineExceeded: If the deadline expired before every output was complete
+    """
+    keys = [cache_key(text, params) if is_deterministic(params) else None for text, params in prompts]
+    outputs = await cached_outputs(keys)
+
+    # Group the indexes of the prompts still to run by their generation parameters,
+    # since one model call can only use one set of parameters
+    groups = {}
+    for index, (text, params) in enumerate(prompts):
+        if outputs[index] is None:
+            groups.setdefault(tuple(sorted(params.items())), []).append((index, text))
+    if not groups:
+        return outputs
+
+    units = sum(math.ceil(len(items) / GENERATE_BATCH_CHUNK_SIZE) for items in groups.values())
+    admitted_at = admission.admit(units)
+
+    started = time.monotonic()
+    chunks = []
+    try:
+        # Sort each group by token length so every chunk pads as little as possible,
+        # then queue the chunks on the inference executor, sharing one deadline.
+        # Up to GENERATE_BATCH_MAX_PROMPTS prompts are tokenized, which would stall
+        # every other request on the event loop, so it happens in one call off it
+        missing = [index for items in groups.values() for index, _ in items]
+        lengths = dict(zip(missing, await run_in_threadpool(token_lengths, [prompts[index][0] for index in missing])))
+        for key, items in groups.items():
+            items.sort(key=lambda item: lengths[item[0]])
+            for start in range(0, len(items), GENERATE_BATCH_CHUNK_SIZE):
+                chunk = items[start:start + GENERATE_BATCH_CHUNK_SIZE]
+                future = executor.submit(run_pipeline_batch, [text for _, text in chunk], deadlines=[deadline] * len(chunk), **dict(key))
+                chunks.append(([index for index, _ in chunk], future))
+
+        results = []
+        for _, future in chunks:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            results.append(await wait_for_result(future, deadline, remaining, is_disconnected))
+        if deadline.expired():
+            raise DeadlineExceeded("Request deadline exceeded during generation")
+    except BaseException:
+        # Whatever ended the wait early (a timeout, a disconnect, or a model error in one
+        # chunk), cancel the shared deadline so the chunks still running stop too, before
+        # their admission units are given back
+        deadline.cancel()
+        raise
+    finally:
+        admission.release(admitted_at, units)
+
+    # Put every output back in the position of its prompt
+    for (indexes, _), texts in zip(chunks, results):
+        for index, text in zip(indexes, texts):
+            outputs[index] = text
+            if keys[index]:
+                response_cache.put(keys[index], text)
+    return outputs
+
+
+def split_long_input(instruction, body):
+    """
+    Split the text of a long-input request into prompts that each fit the model.
+
+    Args:
+        instruction (str): The prompt's instruction, repeated in front of every chunk
+        body (str): The text the instruction applies to
+
+    Returns:
+        list: One prompt per chunk; a single prompt if the text fits
+
+    Raises:
+        HTTPException: 413 if the text needs more than LONG_INPUT_MAX_CHUNKS chunks
+    """
+    prefix = f"{instruction} " if instruction else ""
+    # The chunk budget covers the instruction and the end-of-sequence token too
+    budget = max(LONG_INPUT_CHUNK_TOKENS - token_length(prefix), LONG_INPUT_OVERLAP_TOKENS + 1)
+    chunks = chunk_text(pipe.tokenizer, body, budget, LONG_INPUT_OVERLAP_TOKENS)
+    if len(chunks) > LONG_INPUT_MAX_CHUNKS:
+        raise HTTPException(status_code=413, detail=f"Input too long: at most {LONG_INPUT_MAX_CHUNKS} chunks per request")
+    return [prefix + chunk for chunk in chunks]
+
+# Define the request body models
+# GenerationParams holds the optional decoding settings a client may override;
+# anything left unset falls back to the model's default generation config
+class GenerationParams(BaseModel):
+    max_new_tokens: Optional[int] = Field(None, ge=1)
+    min_new_tokens: Optional[int] = Field(None, ge=0)
+    num_beams: Optional[int] = Field(None, ge=1)
+    do_sample: Optional[bool] = None
+    temperature: Optional[float] = Field(None, gt=0)
+    top_k: Optional[int] = Field(None, ge=0)
+    top_p: Optional[float] = Field(None, gt=0, le=1)
+    repetition_penalty: Optional[float] = Field(None, gt=0)
+    no_repeat_ngram_size: Optional[int] = Field(None, ge=0)
+
+
+class BatchItem(BaseModel):
+    text: str
+    params: Optional[GenerationParams] = None
+
+
+class BatchRequest(BaseModel):
+    prompts: List[Union[str, BatchItem]]
+    params: Optional[GenerationParams] = None
+
+
+class ScoreRequest(BaseModel):
+    text: str
+    candidates: List[str] = Field(min_length=1)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str] = Field(min_length=1)
+    normalize: bool = False
+
 
 # Define the root endpoint
 # The @app.get("/") decorator routes HTTP GET requests for the URL "/" to this function
@@ -47,35 +621,447 @@ def home():
     """
     Root endpoint that returns a welcome message.
     Used for checking if the API is running.
-    
+
     Returns:
         dict: A simple JSON response with a welcome message
     """
     return {"message": "Welcome to the Text Generation API!"}
 
+# Define the stats endpoint
+# Reports how well batching is working so bucket edges can be tuned
+@app.get("/stats")
+def stats():
+    """
+    Report batching, executor, cache, coalescing and admission statistics.
+
+    Returns:
+        dict: Per-bucket batch counts and pad-token ratios, the most recent batches,
+        the executor's thread budget and queue, cache hit/miss/eviction counters,
+        the number of requests collapsed into identical in-flight ones, and
+        admitted/rejected request counts, compile times when the model is compiled,
+        the encoder output cache's hit rate, and prompt lookup acceptance and semantic cache
+        hits when they are enabled
+    """
+    return {
+        "admission": admission.stats(),
+        "batching": batcher.stats.snapshot(),
+        "executor": executor.stats(),
+        "cache": response_cache.stats(),
+        "singleflight": in_flight.stats(),
+        "compile": compile_stats,
+        "encoder_cache": encoder_cache.stats() if encoder_cache is not None else None,
+        "prompt_lookup": pipe.lookup_stats() if PROMPT_LOOKUP_TOKENS else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+    }
+
 # Define the text generation endpoint
 # The @app.get("/generate") decorator routes GET requests for "/generate" to this function
 # The text parameter will be passed as a query parameter, e.g., /generate?text=Hello
+# Optional generation parameters are query parameters too, e.g., &max_new_tokens=32
 @app.get('/generate')
-def generate(text: str):
+async def generate(
+    request: Request,
+    text: str,
+    params: Annotated[GenerationParams, Depends()],
+    timeout: Annotated[Optional[float], Depends(request_timeout)],
+    num_return_sequences: Annotated[Optional[int], Query(ge=1, le=GENERATE_MAX_CANDIDATES)] = None,
+    choices: Annotated[Optional[List[str]], Query()] = None,
+    semantic_cache_enabled: Annotated[bool, Query(alias="semantic_cache")] = True,
+    long_input: Annotated[Optional[Literal["map", "map_reduce"]], Query()] = None,
+    split_sentences_enabled: Annotated[bool, Query(alias="split_sentences")] = True,
+):
     """
     Generate text based on the input using the FLAN-T5 Small model.
-    
+
     Args:
+        request (Request): The incoming request, used to notice client disconnects
         text (str): The input text/prompt for text generation
-              
+        params (GenerationParams): Optional generation parameters
+        timeout (float): Seconds the client is willing to wait, from the timeout_ms
+            query parameter, the X-Timeout-Ms header, or the server default
+        num_return_sequences (int): Optional number of candidates to return, from
+            beam search or, with do_sample, from independent samples
+        choices (list): Optional allowed outputs, one per repeated choices parameter.
+            Decoding is restricted to them, so the output is always one of them;
+            other generation parameters don't apply
+        semantic_cache_enabled (bool): Set the semantic_cache query parameter to false to
+            skip the semantic cache, e.g. when a paraphrase's answer would not do
+        long_input (str): Long-document mode for inputs the model can't read in one pass.
+            The text after the instruction (e.g. "Summarize:") is split into overlapping
+            chunks of LONG_INPUT_CHUNK_TOKENS, each generated for with the instruction in
+            front, as one batch. "map" returns the chunk outputs joined in order;
+            "map_reduce" runs the instruction once more over the joined outputs
+        split_sentences_enabled (bool): Translation prompts ("Translate to German: ...") over
+            texts with paragraph breaks or more than TRANSLATION_SPLIT_MIN_TOKENS tokens are
+            translated one sentence per prompt, as one batch, and joined in order; set the
+            split_sentences query parameter to false to translate the text in one pass
+
     Returns:
-        dict: A JSON response containing the generated text in the 'output' field
-        
+        dict: A JSON response containing the generated text in the 'output' field and,
+        when num_return_sequences is given, every candidate with its score in 'candidates'
+
     Examples:
         Request: GET /generate?text=Translate%20to%20French:%20Hello%20world
         Response: {"output": "Bonjour le monde"}
+
+        Request: GET /generate?text=Translate%20to%20French:%20Hello%20world&num_return_sequences=2
+        Response: {"output": "Bonjour le monde", "candidates": [{"text": "Bonjour le monde", "score": -0.21},
+            {"text": "Salut le monde", "score": -0.87}]}
+
+        Request: GET /generate?text=Is%20this%20review%20positive%3F%20Great%20food&choices=yes&choices=no
+        Response: {"output": "yes"}
+
+        Request: GET /generate?text=Summarize:%20<a%20long%20report>&long_input=map_reduce
+        Response: {"output": "The report covers ..."}
+
+        Request: GET /generate?text=Translate%20to%20German:%20Hello.%0A%0AHow%20are%20you%3F
+        Response: {"output": "Hallo.\n\nWie geht es dir?"}
     """
-    # Process the input text through the pipeline
-    # The pipeline handles tokenization, model inference, and decoding
-    # Returns a list of dictionaries, we take the first (and only) result
-    output = pipe(text)
-    
+    generate_kwargs = params.model_dump(exclude_none=True)
+
+    # Long inputs are mapped chunk by chunk as one batch job; the reduce prompt built from
+    # the chunk outputs then runs as an ordinary request
+    if long_input is not None:
+        if choices is not None or num_return_sequences is not None:
+            raise HTTPException(status_code=422, detail="long_input can't be combined with choices or num_return_sequences")
+        # The combined output is cached under a key that includes the mode, so a repeated
+        # document skips chunking as well as the model
+        long_key = cache_key(text, dict(generate_kwargs, long_input=long_input)) if is_deterministic(generate_kwargs) else None
+        output = await cached_output(long_key) if long_key else None
+        if output is not None:
+            return {"output": output}
+        instruction, body = split_instruction(text)
+        # Tokenizing a whole document would stall every other request, so it happens off the event loop
+        prompts = await run_in_threadpool(split_long_input, instruction, body)
+        if len(prompts) > 1:
+            started = time.monotonic()
+            deadline = Deadline(timeout)
+            # Chunk outputs still too long for one pass are split and mapped again
+            while len(prompts) > 1:
+                remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+                outputs = await generate_all([(prompt, generate_kwargs) for prompt in prompts], deadline, remaining, request.is_disconnected)
+                combined = " ".join(output.strip() for output in outputs)
+                # Without an instruction that shortens its input (e.g. translation) there is nothing to reduce
+                if long_input == "map" or len(combined) >= len(body):
+                    if long_key:
+                        response_cache.put(long_key, combined)
+                    return {"output": combined}
+                body = combined
+                prompts = await run_in_threadpool(split_long_input, instruction, body)
+            if timeout is not None:
+                timeout = max(0.0, timeout - (time.monotonic() - started))
+            # The reduce prompt runs as an ordinary request, and its output is the document's
+            result = await generate(
+                request, prompts[0], params, timeout,
+                semantic_cache_enabled=semantic_cache_enabled, split_sentences_enabled=False,
+            )
+            if long_key:
+                response_cache.put(long_key, result["output"])
+            return result
+
+    # Restricted decoding only computes the allowed tokens' logits, which needs the model's LM head
+    if choices is not None:
+        if engine is None:
+            raise HTTPException(status_code=501, detail=f"Choices are not supported by the {INFERENCE_BACKEND} backend")
+        if not choices or len(choices) > GENERATE_MAX_CHOICES:
+            raise HTTPException(status_code=422, detail=f"Between 1 and {GENERATE_MAX_CHOICES} choices are allowed")
+        deadline = Deadline(timeout)
+        criteria = StoppingCriteriaList([DeadlineCriteria([deadline])])
+        future = admission.guard(lambda: executor.submit(engine.choose, text, choices, stopping_criteria=criteria))
+        output = await wait_for_result(future, deadline, timeout, request.is_disconnected)
+        if output is None:
+            raise DeadlineExceeded("Request deadline exceeded during generation")
+        return {"output": output}
+
+    # Candidates need the transformers model's scores; the prompt is encoded once for all of them
+    if num_return_sequences is not None:
+        if pipe.model is None:
+            raise HTTPException(status_code=501, detail=f"Candidates are not supported by the {INFERENCE_BACKEND} backend")
+        deadline = Deadline(timeout)
+        future = admission.guard(lambda: executor.submit(
+            generate_candidates, pipe.model, pipe.tokenizer, text, num_return_sequences, deadline=deadline, **generate_kwargs
+        ))
+        candidates = await wait_for_result(future, deadline, timeout, request.is_disconnected)
+        return {"output": candidates[0]["text"], "candidates": candidates}
+
+    key = cache_key(text, generate_kwargs) if is_deterministic(generate_kwargs) else None
+
+    # Translate long texts as a batch of short prompts instead of one long decode;
+    # short ones keep their one-pass translation
+    if TRANSLATION_SENTENCE_SPLIT and split_sentences_enabled and long_input is None:
+        instruction, body = split_instruction(text)
+        sentences, separators = split_sentences(body) if is_translation(instruction) else ([], [])
+        # Every token covers at least one byte of the text, so a text this short is never
+        # split and needs no measuring
+        short = len(body.encode("utf-8")) + 4 <= TRANSLATION_SPLIT_MIN_TOKENS
+        if len(sentences) > 1 and (has_paragraphs(separators) or not short):
+            # The joined translation differs from a one-pass one, so it is cached under its own key,
+            # and it is looked up before the text is measured, so a cache hit skips tokenization.
+            # The one-pass output under the plain key (e.g. from split_sentences=false) is no answer here
+            split_key = cache_key(text, dict(generate_kwargs, split_sentences=True)) if key else None
+            output = await cached_output(split_key) if split_key else None
+            if output is not None:
+                return {"output": output}
+            if has_paragraphs(separators) or await run_in_threadpool(token_length, body) > TRANSLATION_SPLIT_MIN_TOKENS:
+                if len(sentences) > TRANSLATION_MAX_SENTENCES:
+                    raise HTTPException(status_code=413, detail=f"At most {TRANSLATION_MAX_SENTENCES} sentences per translation")
+                prompts = [(f"{instruction} {sentence}", generate_kwargs) for sentence in sentences]
+                outputs = await generate_all(prompts, Deadline(timeout), timeout, request.is_disconnected)
+                output = join_sentences(outputs, separators)
+                if split_key:
+                    response_cache.put(split_key, output)
+                return {"output": output}
+
+    # Answer repeated deterministic prompts straight from the cache
+    output = await cached_output(key) if key else None
+    if output is not None:
+        return {"output": output}
+
+    # Queue the prompt on the micro-batcher, unless admission control rejects it
+    # Decoding stops early once the deadline expires or the client disconnects
+    deadline = Deadline(timeout)
+
+    # Answer paraphrases of cached prompts from the semantic cache
+    vector = None
+    if key and semantic_cache is not None and semantic_cache_enabled:
+        started = time.monotonic()
+        embedding = admission.guard(lambda: embed_batcher.submit(text, deadline=deadline, normalize=True))
+        vector = await wait_for_result(embedding, deadline, timeout, request.is_disconnected)
+        output = semantic_cache.get(vector, key[1])
+        if output is not None:
+            return {"output": output}
+        if timeout is not None:
+            timeout = max(0.0, timeout - (time.monotonic() - started))
+
+    def start():
+        return admission.guard(lambda: batcher.submit(text, deadline=deadline, **generate_kwargs))
+
+    # Sampled outputs are not shared, so they always get their own model run
+    if not key:
+        output = await wait_for_result(start(), deadline, timeout, request.is_disconnected)
+        return {"output": output}
+
+    # Hand the prompt to the micro-batcher, or join an identical request already running,
+    # and wait for the result. The batcher handles tokenization, batched model inference,
+    # and decoding. Awaiting (instead of blocking) keeps the request off FastAPI's threadpool.
+    # Joining extends the shared deadline, so the work continues as long as anyone waits for it
+    future, shared_deadline, leader = in_flight.do(key, start, context=deadline)
+    if not leader and not shared_deadline.join(timeout):
+        # The running call is being abandoned, so this request needs its own
+        future, shared_deadline, leader = start(), deadline, True
+    output = await wait_for_result(future, shared_deadline, timeout, request.is_disconnected)
+    if leader:
+        response_cache.put(key, output)
+        if vector is not None:
+            semantic_cache.put(vector, key[1], output)
+
     # Return the generated text as a JSON response
-    # Extracting the 'generated_text' field from the first (and only) result
-    return {"output": output[0]['generated_text']}
\ No newline at end of file
+    return {"output": output}
+
+# Define the streaming text generation endpoint
+# Sends the output as Server-Sent Events while it is being decoded, so clients can
+# render partial output instead of waiting for the whole generation
+@app.get('/generate/stream')
+def generate_stream(text: str, timeout: Annotated[Optional[float], Depends(request_timeout)]):
+    """
+    Stream generated text for the input as Server-Sent Events.
+
+    Args:
+        text (str): The input text/prompt for text generation
+        timeout (float): Seconds the client is willing to wait for the whole output
+
+    Returns:
+        StreamingResponse: A text/event-stream of "token" events carrying new text,
+        ending with a "done" event holding the full output and timings
+
+    Examples:
+        Request: GET /generate/stream?text=Translate%20to%20French:%20Hello%20world
+        Response:
+            event: token
+            data: {"text": "Bonjour "}
+
+            event: done
+            data: {"output": "Bonjour le monde", "time_to_first_token_ms": 41.2, "total_ms": 95.7}
+    """
+    # Streaming attaches a streamer to a transformers model, which not every backend has
+    if pipe.model is None:
+        raise HTTPException(status_code=501, detail=f"Streaming is not supported by the {INFERENCE_BACKEND} backend")
+
+    # Admitting here, before the response starts, lets a rejection still be sent as a 429
+    release = admission.hold()
+
+    # The pipeline's model and tokenizer are driven directly so a streamer can be attached
+    # Generation stops once the deadline expires or the client stops reading
+    def events():
+        try:
+            yield from stream_generate(pipe.model, pipe.tokenizer, executor, text, deadline=Deadline(timeout))
+        finally:
+            release()
+
+    # The admission slot is released when the stream ends, when the response has been sent,
+    # or, if the client went away before the body was ever iterated, when the stream is dropped
+    stream = events()
+    weakref.finalize(stream, release)
+    return StreamingResponse(
+        stream, media_type="text/event-stream", headers={"Cache-Control": "no-cache"}, background=BackgroundTask(release)
+    )
+
+# Define the batch text generation endpoint
+# Bulk clients send many prompts in one POST body instead of one GET per prompt
+@app.post('/generate/batch')
+async def generate_batch(
+    http_request: Request,
+    request: BatchRequest,
+    timeout: Annotated[Optional[float], Depends(request_timeout)],
+):
+    """
+    Generate text for many prompts in one request.
+
+    Prompts that share the same generation parameters are sorted by length and
+    run through the pipeline in chunks of GENERATE_BATCH_CHUNK_SIZE, spread over
+    the inference workers. Deterministic prompts answered before come from the
+    response cache.
+
+    Args:
+        http_request (Request): The incoming request, used to notice client disconnects
+        request (BatchRequest): The prompts, each either a string or an object with
+            its own "params", plus optional default "params" for the whole request
+        timeout (float): Seconds the client is willing to wait for all outputs
+
+    Returns:
+        dict: A JSON response with the generated texts in the 'outputs' field,
+        in the same order as the prompts
+
+    Examples:
+        Request: POST /generate/batch
+            {"prompts": ["Translate to German: Hello", {"text": "Summarize: ...", "params": {"max_new_tokens": 32}}]}
+        Response: {"outputs": ["Hallo", "..."]}
+    """
+    if len(request.prompts) > GENERATE_BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"At most {GENERATE_BATCH_MAX_PROMPTS} prompts per request")
+
+    # Each prompt's effective generation parameters: the request's defaults, overridden by its own
+    defaults = request.params.model_dump(exclude_none=True) if request.params else {}
+    prompts = []
+    for item in request.prompts:
+        if isinstance(item, str):
+            prompts.append((item, defaults))
+        else:
+            prompts.append((item.text, dict(defaults, **(item.params.model_dump(exclude_none=True) if item.params else {}))))
+
+    outputs = await generate_all(prompts, Deadline(timeout), timeout, http_request.is_disconnected)
+    return {"outputs": outputs}
+
+# Define the scoring endpoint
+# Ranking a fixed set of answers needs one teacher-forced decoder pass instead of a generation
+@app.post('/score')
+async def score(
+    http_request: Request,
+    request: ScoreRequest,
+    timeout: Annotated[Optional[float], Depends(request_timeout)],
+):
+    """
+    Score candidate outputs for an input by their log-likelihood under the model.
+
+    The input is encoded once and all candidates are scored against it in a single
+    decoder forward pass.
+
+    Args:
+        http_request (Request): The incoming request, used to notice client disconnects
+        request (ScoreRequest): The input "text" and its "candidates"
+        timeout (float): Seconds the client is willing to wait
+
+    Returns:
+        dict: The most likely candidate in 'best', and for every candidate, in the order
+        given, its total log-likelihood and token count (including the end-of-sequence
+        token) in 'scores'
+
+    Examples:
+        Request: POST /score
+            {"text": "Is this review positive? Great food!", "candidates": ["yes", "no"]}
+        Response: {"best": "yes", "scores": [{"text": "yes", "log_likelihood": -0.12, "tokens": 2},
+            {"text": "no", "log_likelihood": -2.31, "tokens": 2}]}
+    """
+    if engine is None:
+        raise HTTPException(status_code=501, detail=f"Scoring is not supported by the {INFERENCE_BACKEND} backend")
+    if len(request.candidates) > SCORE_MAX_CANDIDATES:
+        raise HTTPException(status_code=413, detail=f"At most {SCORE_MAX_CANDIDATES} candidates per request")
+
+    deadline = Deadline(timeout)
+    future = admission.guard(lambda: executor.submit(engine.score, request.text, request.candidates))
+    results = await wait_for_result(future, deadline, timeout, http_request.is_disconnected)
+    scores = [
+        {"text": text, "log_likelihood": round(log_likelihood, 4), "tokens": tokens}
+        for text, (log_likelihood, tokens) in zip(request.candidates, results)
+    ]
+    best = max(scores, key=lambda entry: entry["log_likelihood"])
+    return {"best": best["text"], "scores": scores}
+
+# Define the embedding endpoint
+# Reuses the loaded model's encoder for lightweight embeddings (deduplication, retrieval)
+@app.post('/embed')
+async def embed(
+    http_request: Request,
+    request: EmbedRequest,
+    timeout: Annotated[Optional[float], Depends(request_timeout)],
+):
+    """
+    Embed texts as mean-pooled encoder hidden states.
+
+    Only the encoder runs. Texts are micro-batched with those of concurrent requests.
+
+    Args:
+        http_request (Request): The incoming request, used to notice client disconnects
+            and to read the Accept header
+        request (EmbedRequest): The "texts" to embed, and whether to "normalize" the
+            vectors to unit length
+        timeout (float): Seconds the client is willing to wait for all embeddings
+
+    Returns:
+        dict: A JSON response with one float32 vector per text in 'embeddings', in the
+        same order, and their size in 'dimensions'. With "Accept: application/octet-stream"
+        the vectors are instead sent as packed little-endian float32 values, one vector
+        after another, with their count and size in the X-Embedding-Count and
+        X-Embedding-Dimensions headers
+
+    Examples:
+        Request: POST /embed
+            {"texts": ["How old are you?", "What is your age?"], "normalize": true}
+        Response: {"embeddings": [[0.013, -0.092, ...], [0.021, -0.087, ...]], "dimensions": 512}
+    """
+    if embed_batcher is None:
+        raise HTTPException(status_code=501, detail=f"Embeddings are not supported by the {INFERENCE_BACKEND} backend")
+    if len(request.texts) > EMBED_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {EMBED_MAX_TEXTS} texts per request")
+
+    # Each batch the texts can fill counts as one unit of admitted work, up to the per-request cap
+    units = math.ceil(len(request.texts) / BATCH_MAX_SIZE)
+    admitted_at = admission.admit(units)
+    started = time.monotonic()
+    deadline = Deadline(timeout)
+    try:
+        # Up to EMBED_MAX_TEXTS texts are tokenized, which would stall every other request
+        # on the event loop, so their lengths are measured in one call off it
+        lengths = await run_in_threadpool(token_lengths, request.texts)
+        futures = [
+            embed_batcher.submit(text, deadline=deadline, length=length, normalize=request.normalize)
+            for text, length in zip(request.texts, lengths)
+        ]
+        vectors = []
+        for future in futures:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            vectors.append(await wait_for_result(future, deadline, remaining, http_request.is_disconnected))
+    finally:
+        admission.release(admitted_at, units)
+
+    dimensions = len(vectors[0])
+    if "application/octet-stream" in http_request.headers.get("accept", ""):
+        packed = array.array("f", (value for vector in vectors for value in vector))
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return Response(
+            content=packed.tobytes(),
+            media_type="application/octet-stream",
+            headers={"X-Embedding-Count": str(len(vectors)), "X-Embedding-Dimensions": str(dimensions)},
+        )
+    return {"embeddings": vectors, "dimensions": dimensions}
@@ -0,0 +1,217 @@
+"""
+Inference backends for the text generation pipeline.
+
+Every backend produces a transformers text2text-generation pipeline, so
+the rest of the app (batching, streaming, deadlines) works the same
+whichever one is selected:
+
+- pytorch: the model in eager PyTorch, as downloaded from the Hub
+- onnx: the encoder and decoder (with past key values) exported to ONNX
+  once, cached on disk, and run with ONNX Runtime on CPU
+- ctranslate2: the model converted to CTranslate2 with int8 weights once,
+  cached on disk, and run by CTranslate2's CPU-optimized decoder. It is
+  wrapped in a small object that is called like a pipeline, but has no
+  PyTorch model behind it
+"""
+
+import os
+
+from transformers import AutoTokenizer, GenerationConfig, pipeline
+
+from deadlines import DeadlineCriteria
+
+BACKENDS = ("pytorch", "onnx", "ctranslate2")
+
+
+def export_dir(cache_dir, model_id, backend):
+    """
+    Args:
+        cache_dir (str): Root directory for converted models
+        model_id (str): Hub id or path of the source model
+        backend (str): Name of the backend the files are converted for
+
+    Returns:
+        str: Directory holding the converted files for this model and backend
+    """
+    name = model_id.strip("/").replace("/", "--")
+    return os.path.join(cache_dir, backend, name)
+
+
+def load_onnx_model(model_id, cache_dir, threads=None):
+    """
+    Load the ONNX export of a seq2seq model, exporting it on first use.
+
+    Args:
+        model_id (str): Hub id or path of the source model
+        cache_dir (str): Root directory where exported models are kept
+        threads (int): Intra-op threads for each ONNX Runtime session
+
+    Returns:
+        ORTModelForSeq2SeqLM: The model running on ONNX Runtime
+    """
+    try:
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError("The onnx backend needs optimum and onnxruntime: pip install 'optimum[onnxruntime]'") from e
+
+    # Keep ONNX Runtime within the same thread budget as PyTorch
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+
+    path = export_dir(cache_dir, model_id, "onnx")
+    if os.path.exists(os.path.join(path, "encoder_model.onnx")):
+        return ORTModelForSeq2SeqLM.from_pretrained(path, use_cache=True, session_options=session_options)
+
+    # First start: export the encoder, decoder and decoder-with-past graphs and keep them
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_id, export=True, use_cache=True)
+    model.save_pretrained(path)
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(path)
+    return ORTModelForSeq2SeqLM.from_pretrained(path, use_cache=True, session_options=session_options)
+
+
+class CTranslate2Pipeline:
+    """
+    Runs a CTranslate2 model behind the same call signature as a
+    text2text-generation pipeline.
+
+    Args:
+        translator (ctranslate2.Translator): The converted model
+        tokenizer: The original model's tokenizer
+        generation_config (GenerationConfig): The original model's generation defaults
+    """
+
+    # There is no transformers model to drive directly (e.g. for token streaming)
+    model = None
+
+    def __init__(self, translator, tokenizer, generation_config):
+        self.translator = translator
+        self.tokenizer = tokenizer
+        self.generation_config = generation_config
+
+    def _options(self, generate_kwargs):
+        """
+        Translate transformers generation parameters into CTranslate2 options.
+
+        Args:
+            generate_kwargs (dict): Generation parameters as accepted by the pipeline
+
+        Returns:
+            dict: Keyword arguments for Translator.translate_batch
+        """
+        config = self.generation_config
+        max_new_tokens = generate_kwargs.get("max_new_tokens") or config.max_new_tokens
+        if not max_new_tokens:
+            # max_length counts the decoder start token, CTranslate2 does not. generate()
+            # always allows 20 new tokens when max_length is left at its default
+            default = config.max_length == GenerationConfig().max_length
+            max_new_tokens = config.max_length if default else config.max_length - 1
+        options = {
+            "beam_size": generate_kwargs.get("num_beams", config.num_beams),
+            "max_decoding_length": max_new_tokens,
+            "min_decoding_length": generate_kwargs.get("min_new_tokens", config.min_new_tokens or 0),
+            "repetition_penalty": generate_kwargs.get("repetition_penalty", config.repetition_penalty),
+            "no_repeat_ngram_size": generate_kwargs.get("no_repeat_ngram_size", config.no_repeat_ngram_size),
+        }
+        if generate_kwargs.get("do_sample", config.do_sample):
+            options["sampling_topk"] = generate_kwargs.get("top_k", config.top_k) or 0
+            options["sampling_topp"] = generate_kwargs.get("top_p", config.top_p)
+            options["sampling_temperature"] = generate_kwargs.get("temperature", config.temperature)
+        return options
+
+    def __call__(self, inputs, batch_size=None, stopping_criteria=None, **generate_kwargs):
+        """
+        Generate text for one prompt or a list of prompts.
+
+        Args:
+            inputs (str or list): The prompt(s)
+            batch_size (int): Maximum number of prompts decoded together
+            stopping_criteria (StoppingCriteriaList): Only deadline criteria are
+                honoured; they stop each prompt's decoding once its deadline expires
+            **generate_kwargs: Generation parameters, as for the pipeline
+
+        Returns:
+            list: One {"generated_text": ...} dict per prompt
+        """
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        source = [self.tokenizer.convert_ids_to_tokens(self.tokenizer.encode(text)) for text in texts]
+        options = self._options(generate_kwargs)
+
+        # CTranslate2 reports every decoded token (greedy search only) to a callback,
+        # which can stop that prompt by returning True
+        deadlines = [
+            criterion.deadlines for criterion in (stopping_criteria or []) if isinstance(criterion, DeadlineCriteria)
+        ]
+        if deadlines and options["beam_size"] == 1:
+            options["callback"] = lambda step: any(
+                group[step.batch_id] is not None and group[step.batch_id].expired() for group in deadlines
+            )
+
+        results = self.translator.translate_batch(source, max_batch_size=batch_size or 0, **options)
+        return [
+            {"generated_text": self.tokenizer.decode(
+                self.tokenizer.convert_tokens_to_ids(result.hypotheses[0]), skip_special_tokens=True
+            )}
+            for result in results
+        ]
+
+
+def load_ctranslate2_pipeline(model_id, cache_dir, threads=None, workers=1):
+    """
+    Load a model converted to CTranslate2, converting it on first use.
+
+    Args:
+        model_id (str): Hub id or path of the source model
+        cache_dir (str): Root directory where converted models are kept
+        threads (int): Threads used by each concurrent model call
+        workers (int): Number of model calls that may run at the same time
+
+    Returns:
+        CTranslate2Pipeline: The converted model, callable like a pipeline
+    """
+    try:
+        import ctranslate2
+        from ctranslate2.converters import TransformersConverter
+    except ImportError as e:
+        raise ImportError("The ctranslate2 backend needs CTranslate2: pip install ctranslate2") from e
+
+    # First start: convert with int8 weights and keep the tokenizer alongside
+    path = export_dir(cache_dir, model_id, "ctranslate2")
+    if not os.path.exists(os.path.join(path, "model.bin")):
+        TransformersConverter(model_id).convert(path, quantization="int8", force=True)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(path)
+
+    translator = ctranslate2.Translator(
+        path,
+        device="cpu",
+        compute_type="int8",
+        inter_threads=max(1, workers),
+        intra_threads=threads or 0,
+    )
+    return CTranslate2Pipeline(translator, AutoTokenizer.from_pretrained(path), GenerationConfig.from_pretrained(model_id))
+
+
+def load_pipeline(backend, model_id, cache_dir, threads=None, workers=1):
+    """
+    Build the text2text-generation pipeline for the selected backend.
+
+    Args:
+        backend (str): One of BACKENDS
+        model_id (str): Hub id or path of the model
+        cache_dir (str): Root directory for converted models
+        threads (int): CPU threads each model call may use, for backends that
+            manage their own thread pools
+        workers (int): Number of model calls that may run at the same time
+
+    Returns:
+        Pipeline: The text2text-generation pipeline
+    """
+    if backend == "pytorch":
+        return pipeline("text2text-generation", model=model_id)
+    if backend == "onnx":
+        model = load_onnx_model(model_id, cache_dir, threads=threads)
+        return pipeline("text2text-generation", model=model, tokenizer=AutoTokenizer.from_pretrained(model_id))
+    if backend == "ctranslate2":
+        return load_ctranslate2_pipeline(model_id, cache_dir, threads=threads, workers=workers)
+    raise ValueError(f"Unsupported INFERENCE_BACKEND: {backend!r} (expected one of {', '.join(BACKENDS)})")
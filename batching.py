@@ -0,0 +1,267 @@
+"""
+Micro-batching scheduler for the text generation pipeline.
+
+Concurrent /generate calls each submit their prompt to a shared queue.
+A background worker sorts pending prompts into token-length buckets and
+runs each bucket through the model as one padded batch once it is full
+or its oldest prompt has waited long enough, then hands each caller its
+own result. Keeping similar lengths together means short prompts are not
+padded out to the longest one in the batch. Prompts are only batched with
+others that use the same generation parameters.
+
+When an inference executor is supplied, a batch is only handed over once
+a worker is free to start it, so requests keep accumulating into larger
+batches while the model is busy.
+"""
+
+import bisect
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from deadlines import DeadlineExceeded
+
+
+class _Request:
+    """A prompt waiting to be batched, along with the future its caller is waiting on."""
+
+    __slots__ = ("text", "params", "deadline", "future", "length", "arrival")
+
+    def __init__(self, text, params, deadline, future, length):
+        self.text = text
+        self.params = params
+        self.deadline = deadline
+        self.future = future
+        self.length = length
+        self.arrival = time.monotonic()
+
+
+class BatchStats:
+    """
+    Running statistics about dispatched batches, used to tune bucket edges.
+
+    Args:
+        history (int): Number of most recent batches kept for the per-batch readout
+    """
+
+    def __init__(self, history=50):
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=history)
+        self._buckets = collections.defaultdict(lambda: {"batches": 0, "requests": 0, "tokens": 0, "padded_tokens": 0})
+
+    def record(self, bucket, lengths):
+        """
+        Record one dispatched batch.
+
+        Args:
+            bucket (str): Label of the bucket the batch came from
+            lengths (list): Token length of each prompt in the batch
+        """
+        padded = max(lengths) * len(lengths)
+        tokens = sum(lengths)
+        with self._lock:
+            self._recent.append({
+                "bucket": bucket,
+                "size": len(lengths),
+                "max_tokens": max(lengths),
+                "pad_ratio": round(1 - tokens / padded, 4) if padded else 0.0,
+            })
+            totals = self._buckets[bucket]
+            totals["batches"] += 1
+            totals["requests"] += len(lengths)
+            totals["tokens"] += tokens
+            totals["padded_tokens"] += padded
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Per-bucket totals (with overall pad-token ratio) and the most recent batches
+        """
+        with self._lock:
+            buckets = {}
+            for label, totals in self._buckets.items():
+                padded = totals["padded_tokens"]
+                buckets[label] = dict(totals, pad_ratio=round(1 - totals["tokens"] / padded, 4) if padded else 0.0)
+            return {"buckets": buckets, "recent_batches": list(self._recent)}
+
+
+class MicroBatcher:
+    """
+    Collects prompts from concurrent callers and runs them together.
+
+    Args:
+        run_batch (callable): Function taking a list of prompts, a matching list of
+            deadlines (keyword argument "deadlines") and generation parameters as
+            keyword arguments, and returning a list of outputs in the same order
+        max_batch_size (int): Maximum number of prompts run in one batch
+        max_wait_ms (float): How long the first prompt in a batch may wait
+            for others to join before the batch is dispatched
+        token_length (callable): Function returning the token length of a prompt.
+            When omitted all prompts share a single bucket
+        bucket_edges (list): Upper token-length bound of each bucket, ascending.
+            Prompts longer than the last edge go into a final overflow bucket
+        executor (InferenceExecutor): Executor the batches run on. When omitted
+            batches run on the scheduler thread itself
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0, token_length=None, bucket_edges=(), executor=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.token_length = token_length
+        self.bucket_edges = sorted(int(edge) for edge in bucket_edges)
+        self.executor = executor
+        self.stats = BatchStats()
+
+        # New requests from callers; only the worker thread touches the buckets
+        self._queue = queue.Queue()
+        self._pending = {}
+
+        # A single daemon thread drains the queue for the lifetime of the process
+        self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, deadline=None, length=None, **generate_kwargs):
+        """
+        Queue a prompt for the next batch in its length bucket.
+
+        Args:
+            text (str): The input text/prompt
+            deadline (Deadline): Optional deadline after which the prompt is abandoned
+            length (int): The prompt's token length, if the caller has measured it already
+            **generate_kwargs: Generation parameters for this prompt
+
+        Returns:
+            Future: Resolves to the generated text for this prompt
+        """
+        future = Future()
+        # Callers may be on the event loop or holding a lock, so a prompt without a length
+        # is measured on the scheduler thread when it is added to a bucket
+        self._queue.put(_Request(text, tuple(sorted(generate_kwargs.items())), deadline, future, length))
+        return future
+
+    def bucket_label(self, length):
+        """
+        Args:
+            length (int): Token length of a prompt
+
+        Returns:
+            str: Label of the bucket the prompt belongs to, e.g. "<=32" or ">256"
+        """
+        if not self.bucket_edges:
+            return "all"
+        index = bisect.bisect_left(self.bucket_edges, length)
+        if index == len(self.bucket_edges):
+            return f">{self.bucket_edges[-1]}"
+        return f"<={self.bucket_edges[index]}"
+
+    def _next_timeout(self):
+        """
+        Returns:
+            float: Seconds until the oldest pending bucket is due, or None if nothing is pending
+        """
+        if not self._pending:
+            return None
+        oldest = min(requests[0].arrival for requests in self._pending.values())
+        return max(0.0, oldest + self.max_wait - time.monotonic())
+
+    def _add(self, request):
+        """
+        Place a request in its bucket, dispatching the bucket once it is full.
+
+        Args:
+            request (_Request): The request to add
+        """
+        if request.length is None:
+            try:
+                request.length = self.token_length(request.text) if self.token_length else 0
+            except Exception as e:
+                # Fail only this request; the scheduler thread must keep running
+                if request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(e)
+                return
+        key = (request.params, self.bucket_label(request.length))
+        bucket = self._pending.setdefault(key, [])
+        bucket.append(request)
+        if len(bucket) >= self.max_batch_size:
+            self._dispatch(key, self._pending.pop(key))
+
+    def _dispatch(self, key, batch):
+        """
+        Hand one batch to the executor and wait until a worker has started it.
+
+        Args:
+            key (tuple): Generation parameters and length bucket the batch came from
+            batch (list): Pending requests
+        """
+        # Skip callers that have already given up
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        expired = [request for request in batch if request.deadline is not None and request.deadline.expired()]
+        for request in expired:
+            request.future.set_exception(DeadlineExceeded("Request deadline exceeded before it was scheduled"))
+        batch = [request for request in batch if request not in expired]
+        if not batch:
+            return
+
+        if self.token_length:
+            self.stats.record(key[1], [request.length for request in batch])
+
+        if self.executor is None:
+            self._run(batch)
+            return
+
+        started = threading.Event()
+        self.executor.submit(self._run, batch, started)
+        started.wait()
+
+    def _run(self, batch, started=None):
+        """
+        Run one batch through the model and resolve each caller's future.
+
+        Args:
+            batch (list): Requests to run
+            started (threading.Event): Set as soon as the batch begins running
+        """
+        if started is not None:
+            started.set()
+
+        try:
+            outputs = self.run_batch(
+                [request.text for request in batch],
+                deadlines=[request.deadline for request in batch],
+                **dict(batch[0].params),
+            )
+        except Exception as e:
+            # A failed batch fails every request in it
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        # Sequences cut short by their deadline are not valid results
+        for request, output in zip(batch, outputs):
+            if request.deadline is not None and request.deadline.expired():
+                request.future.set_exception(DeadlineExceeded("Request deadline exceeded during generation"))
+            else:
+                request.future.set_result(output)
+
+    def _loop(self):
+        while True:
+            # Wait for a new request, but no longer than the oldest bucket may wait
+            try:
+                self._add(self._queue.get(timeout=self._next_timeout()))
+            except queue.Empty:
+                pass
+
+            # Pick up everything that arrived while the model was busy
+            while True:
+                try:
+                    self._add(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Dispatch every bucket whose oldest request has waited long enough
+            now = time.monotonic()
+            for key in [key for key, bucket in self._pending.items() if now - bucket[0].arrival >= self.max_wait]:
+                self._dispatch(key, self._pending.pop(key))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmark
+
+Runs the bundled prompt set (benchmarks/prompts.txt) through each inference
+backend one request at a time, as /generate would, and reports per-request
+latency relative to the first backend along with how often the outputs
+match it exactly. With greedy decoding the onnx backend should match
+pytorch; ctranslate2 runs with int8 weights, so small differences are
+expected there.
+
+Usage:
+  python benchmarks/backend_benchmark.py
+  python benchmarks/backend_benchmark.py --backends pytorch,onnx --repeats 5
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import DEFAULT_PROMPTS, load_prompts, percentile
+
+from backends import BACKENDS, load_pipeline
+
+
+def benchmark(pipe, prompts, repeats):
+    """
+    Time each prompt through a pipeline.
+
+    Returns:
+        tuple: (latencies in ms, greedy output for each prompt)
+    """
+    # Warm up so one-off allocations and lazy initialization aren't measured
+    pipe(prompts[0])
+
+    latencies = []
+    outputs = []
+    for prompt in prompts:
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            output = pipe(prompt)[0]["generated_text"]
+            latencies.append((time.perf_counter() - start) * 1000)
+        outputs.append(output)
+    return latencies, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-request latency of inference backends')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='Comma-separated backends; the first is the baseline')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS, help='File with one prompt per line')
+    parser.add_argument('--repeats', type=int, default=3, help='Times each prompt is run')
+    parser.add_argument('--cache-dir', default=os.getenv('BACKEND_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'text-generation-api')),
+                        help='Where converted models are kept')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads per model call')
+    args = parser.parse_args()
+
+    import torch
+    torch.set_num_threads(args.threads)
+
+    prompts = load_prompts(args.prompts)
+    backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+
+    results = {}
+    for backend in backends:
+        start = time.perf_counter()
+        pipe = load_pipeline(backend, args.model, args.cache_dir, threads=args.threads)
+        load_seconds = time.perf_counter() - start
+        latencies, outputs = benchmark(pipe, prompts, args.repeats)
+        results[backend] = {"load_seconds": load_seconds, "latencies": latencies, "outputs": outputs}
+        del pipe
+
+    baseline = results[backends[0]]
+    baseline_mean = statistics.mean(baseline["latencies"])
+    print(f"Model: {args.model} ({len(prompts)} prompts, {args.repeats} repeats, {args.threads} threads)")
+    print(f"{'backend':12}{'load (s)':>10}{'mean (ms)':>12}{'p50 (ms)':>11}{'p95 (ms)':>11}{'delta':>9}{'same output':>13}")
+    for backend in backends:
+        result = results[backend]
+        mean = statistics.mean(result["latencies"])
+        agreement = sum(a == b for a, b in zip(result["outputs"], baseline["outputs"])) / len(prompts)
+        print(
+            f"{backend:12}{result['load_seconds']:>10.2f}{mean:>12.2f}"
+            f"{statistics.median(result['latencies']):>11.2f}{percentile(result['latencies'], 0.95):>11.2f}"
+            f"{(mean / baseline_mean - 1) * 100:>+8.1f}%{agreement:>13.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Importing this module also makes the app's modules (in the repository
+root) importable, whichever directory a benchmark is run from.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_PROMPTS = os.path.join(ROOT, "benchmarks", "prompts.txt")
+
+
+def rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Not Linux: fall back to the peak RSS (KB on Linux, bytes on macOS)
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_prompts(path):
+    """Read the non-empty lines of a prompt file"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def percentile(values, fraction):
+    """Value below which the given fraction of the sorted values fall"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compile Report
+
+Measures the torch.compile mode (MODEL_COMPILE=1) against eager PyTorch on
+the bundled prompt set (benchmarks/prompts.txt): how long each length
+bucket takes to compile and warm up, steady-state decoding latency per
+generated token, and whether the outputs still match eager exactly.
+Every prompt generates the same number of tokens, so per-token figures are
+comparable between prompts.
+
+Usage:
+  python benchmarks/compile_report.py
+  python benchmarks/compile_report.py --buckets 32,64 --tokens 32 --repeats 5
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import DEFAULT_PROMPTS, load_prompts, percentile
+
+
+def per_token_latencies(pipe, prompts, tokens, repeats):
+    """
+    Time fixed-length generations for each prompt.
+
+    Returns:
+        tuple: (latency per generated token in ms for each run, output for each prompt)
+    """
+    kwargs = {"max_new_tokens": tokens, "min_new_tokens": tokens}
+    pipe(prompts[0], **kwargs)
+
+    latencies = []
+    outputs = []
+    for prompt in prompts:
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            output = pipe(prompt, **kwargs)[0]["generated_text"]
+            latencies.append((time.perf_counter() - start) * 1000 / tokens)
+        outputs.append(output)
+    return latencies, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare torch.compile and eager decoding latency')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS, help='File with one prompt per line')
+    parser.add_argument('--buckets', default=os.getenv('COMPILE_LENGTH_BUCKETS', '32,64,128,256,512'),
+                        help='Comma-separated encoder length buckets')
+    parser.add_argument('--tokens', type=int, default=32, help='Tokens generated per prompt')
+    parser.add_argument('--repeats', type=int, default=3, help='Times each prompt is run')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads per model call')
+    args = parser.parse_args()
+
+    import torch
+    from transformers import pipeline
+    from compiled import compile_model
+
+    torch.set_num_threads(args.threads)
+    prompts = load_prompts(args.prompts)
+    buckets = [int(length) for length in args.buckets.split(',') if length.strip()]
+
+    pipe = pipeline("text2text-generation", model=args.model)
+    eager, eager_outputs = per_token_latencies(pipe, prompts, args.tokens, args.repeats)
+
+    # The model is compiled in place, so the eager measurements have to come first
+    compile_stats = compile_model(pipe.model, buckets)
+    compiled, compiled_outputs = per_token_latencies(pipe, prompts, args.tokens, args.repeats)
+
+    agreement = sum(a == b for a, b in zip(eager_outputs, compiled_outputs)) / len(prompts)
+    print(f"Model: {args.model} ({len(prompts)} prompts, {args.tokens} tokens, {args.repeats} repeats, {args.threads} threads)")
+    print("Compile and warm-up time per bucket:")
+    for bucket, seconds in compile_stats["buckets"].items():
+        print(f"  {bucket:>5} tokens: {seconds:>8.2f} s")
+    print(f"  total:        {compile_stats['total_seconds']:>8.2f} s")
+    print(f"{'per token (ms)':24}{'eager':>10}{'compiled':>10}{'change':>10}")
+    for label, measure in [
+        ("mean", statistics.mean),
+        ("p50", statistics.median),
+        ("p95", lambda values: percentile(values, 0.95)),
+    ]:
+        before, after = measure(eager), measure(compiled)
+        print(f"{label:24}{before:>10.2f}{after:>10.2f}{(after / before - 1) * 100:>+9.1f}%")
+    print(f"Output agreement: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Continuous Batching Benchmark
+
+Compares static micro-batching (BATCHING_MODE=static) with continuous
+batching (BATCHING_MODE=continuous) under concurrent load. Requests for
+the bundled prompt set (benchmarks/prompts.txt) arrive at a fixed rate,
+and each asks for exactly one of the given output lengths, so short and
+long answers are mixed the way they are in real traffic. A static batch
+returns all its prompts when the longest one finishes; continuous batching
+returns each as soon as it is done. Latency is reported per output length,
+so the effect on short requests is visible separately.
+
+Usage:
+  python benchmarks/continuous_benchmark.py
+  python benchmarks/continuous_benchmark.py --rate 20 --requests 200 --lengths 4,16,64
+"""
+
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+
+from common import DEFAULT_PROMPTS, load_prompts, percentile
+
+
+def run_load(batcher, workload, rate):
+    """
+    Submit requests at a fixed rate and wait for all of them.
+
+    Args:
+        batcher: MicroBatcher or ContinuousBatcher the requests are submitted to
+        workload (list): (prompt, output length) per request
+        rate (float): Requests submitted per second
+
+    Returns:
+        tuple: (latency in ms for each request, output for each request, seconds to finish all of them)
+    """
+    latencies = [None] * len(workload)
+    done = threading.Semaphore(0)
+
+    def finished(index, submitted):
+        def callback(future):
+            latencies[index] = (time.perf_counter() - submitted) * 1000
+            done.release()
+        return callback
+
+    futures = []
+    started = time.perf_counter()
+    for index, (prompt, tokens) in enumerate(workload):
+        # Submit on schedule, so a slow mode builds a queue instead of slowing the load down
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        future = batcher.submit(prompt, max_new_tokens=tokens, min_new_tokens=tokens)
+        future.add_done_callback(finished(index, time.perf_counter()))
+        futures.append(future)
+    for _ in workload:
+        done.acquire()
+    elapsed = time.perf_counter() - started
+    return latencies, [future.result() for future in futures], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare tail latency of static and continuous batching')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS, help='File with one prompt per line')
+    parser.add_argument('--lengths', default='8,64', help='Comma-separated output lengths, in tokens, mixed evenly')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per mode')
+    parser.add_argument('--rate', type=float, default=10.0, help='Requests submitted per second')
+    parser.add_argument('--max-batch-size', type=int, default=8, help='Prompts per batch (static) or decoded together (continuous)')
+    parser.add_argument('--max-wait-ms', type=float, default=10.0, help='How long a static batch waits for more prompts')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads for model calls')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the order of prompts and lengths')
+    args = parser.parse_args()
+
+    from transformers import pipeline
+    from batching import MicroBatcher
+    from continuous import ContinuousBatcher
+    from engine import GenerationEngine
+    from executor import InferenceExecutor
+
+    prompts = load_prompts(args.prompts)
+    lengths = [int(length) for length in args.lengths.split(',') if length.strip()]
+    rng = random.Random(args.seed)
+    workload = [(rng.choice(prompts), lengths[index % len(lengths)]) for index in range(args.requests)]
+    rng.shuffle(workload)
+
+    pipe = pipeline("text2text-generation", model=args.model)
+    engine = GenerationEngine(pipe.model, pipe.tokenizer)
+    executor = InferenceExecutor(workers=1, total_threads=args.threads)
+
+    def run_batch(texts, deadlines=None, **generate_kwargs):
+        return [output['generated_text'] for output in pipe(texts, batch_size=len(texts), **generate_kwargs)]
+
+    batchers = {
+        "static": MicroBatcher(
+            run_batch,
+            max_batch_size=args.max_batch_size,
+            max_wait_ms=args.max_wait_ms,
+            token_length=lambda text: len(pipe.tokenizer(text)['input_ids']),
+            executor=executor,
+        ),
+        "continuous": ContinuousBatcher(engine, run_batch, max_active=args.max_batch_size, executor=executor),
+    }
+
+    # Warm up so one-off allocations and lazy initialization aren't measured
+    for batcher in batchers.values():
+        batcher.submit(prompts[0], max_new_tokens=lengths[0]).result()
+
+    results = {}
+    for name, batcher in batchers.items():
+        results[name] = run_load(batcher, workload, args.rate)
+
+    agreement = sum(a == b for a, b in zip(results["static"][1], results["continuous"][1])) / len(workload)
+    print(f"Model: {args.model} ({args.requests} requests at {args.rate:g}/s, lengths {lengths}, "
+          f"batch size {args.max_batch_size}, {args.threads} threads)")
+    print(f"{'':12}{'tokens':>8}{'mean (ms)':>12}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}")
+    for name, (latencies, outputs, elapsed) in results.items():
+        groups = [(str(tokens), [latency for latency, (_, length) in zip(latencies, workload) if length == tokens])
+                  for tokens in lengths]
+        for label, values in groups + [("all", latencies)]:
+            print(
+                f"{name:12}{label:>8}{statistics.mean(values):>12.2f}{statistics.median(values):>11.2f}"
+                f"{percentile(values, 0.95):>11.2f}{percentile(values, 0.99):>11.2f}"
+            )
+        print(f"{name:12}{'':>8}throughput {args.requests / elapsed:.2f} requests/s")
+    print(f"Output agreement: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
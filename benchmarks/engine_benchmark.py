@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Engine Benchmark
+
+Compares the transformers pipeline with the lean generation engine
+(GENERATION_ENGINE=lean) on the bundled prompt set (benchmarks/prompts.txt),
+one request at a time as /generate runs them. Both run the same PyTorch
+model, so the difference is the per-request and per-step overhead around
+it, which matters most for short prompts and outputs. Requests alternate
+between the two so background load affects both equally.
+
+Usage:
+  python benchmarks/engine_benchmark.py
+  python benchmarks/engine_benchmark.py --max-new-tokens 8 --repeats 10
+  python benchmarks/engine_benchmark.py --num-beams 4
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import DEFAULT_PROMPTS, load_prompts, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-request latency of the pipeline and the lean engine')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS, help='File with one prompt per line')
+    parser.add_argument('--max-new-tokens', type=int, help='Tokens generated per prompt (the model default when omitted)')
+    parser.add_argument('--num-beams', type=int, default=1, help='Beams per prompt')
+    parser.add_argument('--repeats', type=int, default=5, help='Times each prompt is run')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads per model call')
+    args = parser.parse_args()
+
+    import torch
+    from transformers import pipeline
+    from engine import GenerationEngine
+
+    torch.set_num_threads(args.threads)
+    prompts = load_prompts(args.prompts)
+    kwargs = {"num_beams": args.num_beams}
+    if args.max_new_tokens:
+        kwargs["max_new_tokens"] = args.max_new_tokens
+
+    pipe = pipeline("text2text-generation", model=args.model)
+    runners = {"pipeline": pipe, "engine": GenerationEngine(pipe.model, pipe.tokenizer)}
+
+    # Warm up so one-off allocations and lazy initialization aren't measured
+    for run in runners.values():
+        run(prompts[0], **kwargs)
+
+    latencies = {name: [] for name in runners}
+    outputs = {name: [] for name in runners}
+    for prompt in prompts:
+        for repeat in range(args.repeats):
+            for name, run in runners.items():
+                start = time.perf_counter()
+                output = run(prompt, **kwargs)[0]["generated_text"]
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                if repeat == 0:
+                    outputs[name].append(output)
+
+    agreement = sum(a == b for a, b in zip(outputs["pipeline"], outputs["engine"])) / len(prompts)
+    baseline = statistics.mean(latencies["pipeline"])
+    print(f"Model: {args.model} ({len(prompts)} prompts, {args.repeats} repeats, {args.num_beams} beams, {args.threads} threads)")
+    print(f"{'':10}{'mean (ms)':>12}{'p50 (ms)':>11}{'p95 (ms)':>11}{'delta':>9}")
+    for name in runners:
+        mean = statistics.mean(latencies[name])
+        print(
+            f"{name:10}{mean:>12.2f}{statistics.median(latencies[name]):>11.2f}"
+            f"{percentile(latencies[name], 0.95):>11.2f}{(mean / baseline - 1) * 100:>+8.1f}%"
+        )
+    print(f"Output agreement: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
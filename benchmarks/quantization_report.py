@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Quantization Report
+
+Compares the fp32 model with its dynamic int8 quantized version on the
+bundled prompt set (benchmarks/prompts.txt): per-prompt latency, batched
+throughput, resident memory, and how often the two produce the same output.
+Each variant runs in its own process so memory figures don't overlap.
+
+Usage:
+  python benchmarks/quantization_report.py
+  python benchmarks/quantization_report.py --model google/flan-t5-small --batch-size 8 --repeats 3
+  python benchmarks/quantization_report.py --json report.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import DEFAULT_PROMPTS, load_prompts, percentile, rss_mb
+
+
+def run_variant(args):
+    """Load one variant, run the prompt set, and print the measurements as JSON"""
+    from transformers import pipeline
+    from quantization import quantize_dynamic_int8
+
+    prompts = load_prompts(args.prompts)
+
+    baseline_rss = rss_mb()
+    start = time.perf_counter()
+    pipe = pipeline("text2text-generation", model=args.model)
+    if args.variant == "int8":
+        pipe.model = quantize_dynamic_int8(pipe.model)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up so one-off allocations don't land in the first measurement
+    pipe(prompts[0])
+
+    # Latency: one prompt at a time, as a single /generate request would run
+    latencies = []
+    outputs = []
+    for prompt in prompts:
+        for repeat in range(args.repeats):
+            start = time.perf_counter()
+            output = pipe(prompt)[0]["generated_text"]
+            latencies.append((time.perf_counter() - start) * 1000)
+        outputs.append(output)
+
+    # Throughput: the whole set in padded batches, as the micro-batcher runs it
+    start = time.perf_counter()
+    for repeat in range(args.repeats):
+        pipe(prompts, batch_size=args.batch_size)
+    throughput = len(prompts) * args.repeats / (time.perf_counter() - start)
+
+    print(json.dumps({
+        "variant": args.variant,
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(rss_mb() - baseline_rss, 1),
+        "latency_ms_p50": round(statistics.median(latencies), 2),
+        "latency_ms_p95": round(percentile(latencies, 0.95), 2),
+        "throughput_per_s": round(throughput, 2),
+        "outputs": outputs,
+    }))
+
+
+def measure(args, variant):
+    """Run one variant in a fresh process and return its measurements"""
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--variant", variant,
+        "--model", args.model,
+        "--prompts", args.prompts,
+        "--batch-size", str(args.batch_size),
+        "--repeats", str(args.repeats),
+    ]
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fp32 and dynamic int8 inference')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=DEFAULT_PROMPTS, help='File with one prompt per line')
+    parser.add_argument('--batch-size', type=int, default=8, help='Batch size for the throughput run')
+    parser.add_argument('--repeats', type=int, default=3, help='Times each measurement is repeated')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    parser.add_argument('--variant', choices=['fp32', 'int8'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: measure a single variant
+    if args.variant:
+        run_variant(args)
+        return
+
+    fp32 = measure(args, "fp32")
+    int8 = measure(args, "int8")
+
+    pairs = list(zip(fp32["outputs"], int8["outputs"]))
+    agreement = sum(a == b for a, b in pairs) / len(pairs)
+    disagreements = [
+        {"prompt": prompt, "fp32": a, "int8": b}
+        for prompt, (a, b) in zip(load_prompts(args.prompts), pairs) if a != b
+    ]
+
+    print(f"Model: {args.model} ({len(pairs)} prompts, {args.repeats} repeats)")
+    print(f"{'':24}{'fp32':>12}{'int8':>12}{'change':>10}")
+    for field, label in [
+        ("load_seconds", "load time (s)"),
+        ("rss_mb", "model RSS (MB)"),
+        ("latency_ms_p50", "latency p50 (ms)"),
+        ("latency_ms_p95", "latency p95 (ms)"),
+        ("throughput_per_s", "throughput (prompts/s)"),
+    ]:
+        change = (int8[field] / fp32[field] - 1) * 100 if fp32[field] else 0.0
+        print(f"{label:24}{fp32[field]:>12}{int8[field]:>12}{change:>+9.1f}%")
+    print(f"Output agreement: {agreement:.1%}")
+    for item in disagreements:
+        print(f"  - {item['prompt']}\n      fp32: {item['fp32']}\n      int8: {item['int8']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"fp32": fp32, "int8": int8, "agreement": agreement, "disagreements": disagreements}, f, indent=2)
+        print(f"✅ Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
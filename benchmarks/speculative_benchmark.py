@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Speculative Decoding Benchmark
+
+Compares plain greedy decoding in the lean engine with prompt lookup
+(PROMPT_LOOKUP_TOKENS), which copies drafts from the prompt and verifies
+them in one decoder forward. Its benefit depends on how much of the output
+repeats the input, so the default prompt set is copy-heavy rewriting,
+grammar fixing and extraction (benchmarks/rewrite_prompts.txt); run it on
+benchmarks/prompts.txt too to see the cost when little is copied. Requests
+alternate between the two modes so background load affects both equally,
+and their outputs are compared, since prompt lookup must not change them.
+
+Usage:
+  python benchmarks/speculative_benchmark.py
+  python benchmarks/speculative_benchmark.py --lookup-tokens 10 --lookup-ngram 2
+  python benchmarks/speculative_benchmark.py --prompts benchmarks/prompts.txt
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from common import ROOT, load_prompts, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare greedy decoding with and without prompt lookup')
+    parser.add_argument('--model', default=os.getenv('MODEL_ID', 'google/flan-t5-small'), help='Model id or path')
+    parser.add_argument('--prompts', default=os.path.join(ROOT, 'benchmarks', 'rewrite_prompts.txt'),
+                        help='File with one prompt per line')
+    parser.add_argument('--max-new-tokens', type=int, default=64, help='Maximum tokens generated per prompt')
+    parser.add_argument('--lookup-tokens', type=int, default=8, help='Maximum draft tokens per decoder forward')
+    parser.add_argument('--lookup-ngram', type=int, default=3, help='Longest run of generated tokens matched in the prompt')
+    parser.add_argument('--repeats', type=int, default=5, help='Times each prompt is run')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='CPU threads per model call')
+    args = parser.parse_args()
+
+    import torch
+    from transformers import pipeline
+    from engine import GenerationEngine
+
+    torch.set_num_threads(args.threads)
+    prompts = load_prompts(args.prompts)
+    kwargs = {"max_new_tokens": args.max_new_tokens}
+
+    pipe = pipeline("text2text-generation", model=args.model)
+    lookup = GenerationEngine(pipe.model, pipe.tokenizer, lookup_tokens=args.lookup_tokens, lookup_ngram=args.lookup_ngram)
+    runners = {"greedy": GenerationEngine(pipe.model, pipe.tokenizer), "lookup": lookup}
+
+    # Warm up so one-off allocations and lazy initialization aren't measured
+    for run in runners.values():
+        run(prompts[0], **kwargs)
+
+    latencies = {name: [] for name in runners}
+    outputs = {name: [] for name in runners}
+    for prompt in prompts:
+        for repeat in range(args.repeats):
+            for name, run in runners.items():
+                start = time.perf_counter()
+                output = run(prompt, **kwargs)[0]["generated_text"]
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                if repeat == 0:
+                    outputs[name].append(output)
+
+    agreement = sum(a == b for a, b in zip(outputs["greedy"], outputs["lookup"])) / len(prompts)
+    baseline = statistics.mean(latencies["greedy"])
+    stats = lookup.lookup_stats()
+    print(f"Model: {args.model} ({len(prompts)} prompts, {args.repeats} repeats, up to {args.max_new_tokens} tokens, "
+          f"{args.lookup_tokens} draft tokens, {args.lookup_ngram}-gram lookup, {args.threads} threads)")
+    print(f"{'':10}{'mean (ms)':>12}{'p50 (ms)':>11}{'p95 (ms)':>11}{'speedup':>10}")
+    for name in runners:
+        mean = statistics.mean(latencies[name])
+        print(
+            f"{name:10}{mean:>12.2f}{statistics.median(latencies[name]):>11.2f}"
+            f"{percentile(latencies[name], 0.95):>11.2f}{baseline / mean:>9.2f}x"
+        )
+    print(f"Draft acceptance: {stats['acceptance_rate']:.1%} of {stats['drafted']} drafted tokens, "
+          f"{stats['tokens_per_forward']:.2f} tokens per decoder forward")
+    print(f"Output agreement: {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
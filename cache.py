@@ -0,0 +1,405 @@
+"""
+Response caches for generated text.
+
+With greedy decoding the model is deterministic, so a prompt seen before
+with the same generation parameters can be answered without tokenizing or
+running the model. The in-process LRU cache is bounded both by number of
+entries and by the total size of the stored text, evicting the least
+recently used entries first. It can optionally sit on top of a SQLite
+cache on disk, which survives restarts so a fresh process starts warm.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(text, params):
+    """
+    Build the cache key for a prompt and its generation parameters.
+
+    Args:
+        text (str): The input prompt
+        params (dict): Generation parameters used for the prompt
+
+    Returns:
+        tuple: A hashable key covering the prompt and every parameter
+    """
+    return (text, tuple(sorted(params.items())))
+
+
+def is_deterministic(params):
+    """
+    Args:
+        params (dict): Generation parameters
+
+    Returns:
+        bool: Whether the same prompt always produces the same output with these parameters
+    """
+    return not params.get("do_sample")
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache bounded by entry count and total bytes.
+
+    Args:
+        max_entries (int): Maximum number of cached responses. 0 disables the cache
+        max_bytes (int): Maximum total size of cached prompts and outputs, in UTF-8 bytes
+        disk (DiskCache): Optional persistent tier consulted on a miss and
+            written through on every put
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, disk=None):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.disk = disk
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+
+        # Start warm with the most recently used responses from disk
+        if disk is not None and self.max_entries:
+            for key, value in disk.recent(self.max_entries):
+                self._store(key, value)
+
+    @staticmethod
+    def _size(key, value):
+        return len(key[0].encode("utf-8")) + len(value.encode("utf-8"))
+
+    def get(self, key):
+        """
+        Look up a response, marking it as recently used.
+
+        Args:
+            key (tuple): Key from cache_key()
+
+        Returns:
+            str: The cached output, or None on a miss
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        # Fall back to the disk tier and promote what it finds
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+            return value
+
+    def put(self, key, value):
+        """
+        Store a response, evicting least recently used entries to stay within bounds.
+
+        Args:
+            key (tuple): Key from cache_key()
+            value (str): The generated output
+        """
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        """
+        Insert an entry and evict down to the bounds. The caller must hold the lock.
+
+        Args:
+            key (tuple): Key from cache_key()
+            value (str): The generated output
+        """
+        size = self._size(key, value)
+        if not self.max_entries or size > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= self._size(key, previous)
+        self._entries[key] = value
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_value)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count, size in bytes, hit/miss/eviction counters, and the
+            disk tier's statistics when one is configured
+        """
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+class DiskCache:
+    """
+    Persistent response cache stored in a SQLite database.
+
+    Entries are keyed by model id, prompt and generation parameters, so a
+    database shared across model changes never serves stale outputs. When the
+    stored text exceeds max_bytes the least recently used entries are deleted,
+    and once enough space has been freed the database file is compacted.
+
+    Lookups read through their own connection. Everything that writes (new
+    responses, last-used times, eviction and compaction) is queued and done by
+    a background thread, so a caller never waits for a write or a VACUUM; in
+    WAL mode reads proceed while it runs. If writes fall behind by more than
+    max_pending, new ones are dropped, which only costs future hits.
+
+    Args:
+        path (str): Path of the SQLite database file
+        model_id (str): Id of the model whose outputs are stored, including anything
+            that changes its outputs, such as the backend or quantization
+        max_bytes (int): Maximum total size of stored prompts and outputs
+        max_pending (int): Maximum number of queued writes
+    """
+
+    def __init__(self, path, model_id, max_bytes=256 * 1024 * 1024, max_pending=10000):
+        self.path = path
+        self.model_id = model_id
+        self.max_bytes = max(0, int(max_bytes))
+        self.evictions = 0
+        self.dropped = 0
+        self.errors = 0
+        self._freed = 0
+        self._lock = threading.Lock()
+        self._writes = queue.Queue(maxsize=max(1, int(max_pending)))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # The writer's connection is only used by the writer thread (and here, before it starts)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " id TEXT PRIMARY KEY, model TEXT NOT NULL, prompt TEXT NOT NULL, params TEXT NOT NULL,"
+            " output TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_model_last_used ON responses (model, last_used)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+        # Track the stored size in memory so inserts don't have to scan the table
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        # Bring a database left over from a previous run back within bounds, before serving.
+        # Rewriting the file delays startup, so like at runtime it only happens once a
+        # quarter of the budget has been deleted
+        self._evict()
+        if self._freed > self.max_bytes // 4:
+            self._vacuum()
+
+        # Readers share one connection, serialized by the lock
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+        # A single daemon thread applies the queued writes for the lifetime of the process
+        self._writer = threading.Thread(target=self._loop, name="disk-cache-writer", daemon=True)
+        self._writer.start()
+
+    def _id(self, key):
+        """
+        Args:
+            key (tuple): Key from cache_key()
+
+        Returns:
+            str: Stable row id covering the model id, prompt and parameters
+        """
+        text, params = key
+        payload = json.dumps([self.model_id, text, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _enqueue(self, write):
+        try:
+            self._writes.put_nowait(write)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, key):
+        """
+        Look up a response, marking it as recently used.
+
+        Args:
+            key (tuple): Key from cache_key()
+
+        Returns:
+            str: The stored output, or None if it is not on disk
+        """
+        row_id = self._id(key)
+        with self._lock:
+            row = self._reader.execute("SELECT output FROM responses WHERE id = ?", (row_id,)).fetchone()
+        if row is None:
+            return None
+        self._enqueue(("touch", row_id, time.time()))
+        return row[0]
+
+    def put(self, key, value):
+        """
+        Queue a response to be stored; least recently used entries are evicted to stay within max_bytes.
+
+        Args:
+            key (tuple): Key from cache_key()
+            value (str): The generated output
+        """
+        text, params = key
+        size = len(text.encode("utf-8")) + len(value.encode("utf-8"))
+        self._enqueue(("put", self._id(key), text, json.dumps(params), value, size, time.time()))
+
+    def recent(self, limit):
+        """
+        Load the most recently used responses for this model.
+
+        Args:
+            limit (int): Maximum number of entries to load
+
+        Returns:
+            list: (key, output) pairs, least recently used first
+        """
+        with self._lock:
+            rows = self._reader.execute(
+                "SELECT prompt, params, output FROM responses WHERE model = ? ORDER BY last_used DESC LIMIT ?",
+                (self.model_id, int(limit)),
+            ).fetchall()
+        return [((prompt, tuple(tuple(item) for item in json.loads(params))), output) for prompt, params, output in reversed(rows)]
+
+    def compact(self):
+        """Queue an eviction down to max_bytes and a rewrite of the database file to reclaim deleted space."""
+        self._enqueue(("compact",))
+
+    def flush(self):
+        """Wait until every queued write has been applied."""
+        self._writes.join()
+
+    def _loop(self):
+        while True:
+            writes = [self._writes.get()]
+            # Apply whatever else is waiting in the same transaction
+            while True:
+                try:
+                    writes.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(writes)
+            except Exception:
+                # E.g. the database is locked by another process or the disk is full. Losing
+                # a batch only costs future hits, but the writer has to keep running
+                self.errors += 1
+                logger.exception("Disk cache writes failed, %d dropped", len(writes))
+            finally:
+                for _ in writes:
+                    self._writes.task_done()
+
+    def _apply(self, writes):
+        """
+        Apply queued writes in one transaction, then evict and compact as needed. Writer thread only.
+
+        Args:
+            writes (list): ("put", id, prompt, params, output, size, time), ("touch", id, time)
+                and ("compact",) tuples
+        """
+        compact = False
+        added = 0
+        self._db.execute("BEGIN")
+        try:
+            for write in writes:
+                if write[0] == "compact":
+                    compact = True
+                    continue
+                if write[0] == "touch":
+                    _, row_id, last_used = write
+                    self._db.execute("UPDATE responses SET last_used = ? WHERE id = ?", (last_used, row_id))
+                    continue
+                _, row_id, text, params, value, size, last_used = write
+                previous = self._db.execute("SELECT size FROM responses WHERE id = ?", (row_id,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (id, model, prompt, params, output, size, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row_id, self.model_id, text, params, value, size, last_used),
+                )
+                added += size - (previous[0] if previous else 0)
+            self._db.execute("COMMIT")
+        except Exception:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            raise
+        # Only committed rows count towards the stored size
+        self._total += added
+        self._evict()
+
+        # Reclaim the file space once a quarter of the budget has been deleted
+        if compact or self._freed > self.max_bytes // 4:
+            self._vacuum()
+
+    def _evict(self):
+        """Delete least recently used entries until the stored size fits in max_bytes. Writer thread only."""
+        if self._total <= self.max_bytes:
+            return
+
+        # Free a little more than needed so evictions don't run on every insert
+        target = self._total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for row_id, size in self._db.execute("SELECT id, size FROM responses ORDER BY last_used"):
+            if freed >= target:
+                break
+            doomed.append((row_id,))
+            freed += size
+        self._db.executemany("DELETE FROM responses WHERE id = ?", doomed)
+        self.evictions += len(doomed)
+        self._total -= freed
+        self._freed += freed
+
+    def _vacuum(self):
+        """Rewrite the database file to reclaim deleted space. Writer thread only."""
+        self._db.execute("VACUUM")
+        self._freed = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Stored entry count and size, file size, queued, dropped and failed writes, and eviction counter
+        """
+        with self._lock:
+            entries = self._reader.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "entries": entries,
+            "bytes": self._total,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "pending_writes": self._writes.qsize(),
+            "dropped_writes": self.dropped,
+            "write_errors": self.errors,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,94 @@
+"""
+Several alternative outputs for one prompt.
+
+Instead of calling /generate N times, a client can ask for N candidates
+in one request. The prompt is encoded once and generate() expands the
+encoder output for the decoder rows, so the extra candidates only add
+decoder work. Candidates come from beam search (the N best beams) or,
+with sampling, from N independent samples.
+
+Every candidate carries a score: its log-probability under the decoding
+distribution divided by its length raised to the length penalty, which is
+the score beam search ranks beams by. Candidates are returned best first.
+"""
+
+import torch
+from transformers import StoppingCriteriaList
+
+from deadlines import DeadlineCriteria, DeadlineExceeded
+
+
+def generate_candidates(model, tokenizer, text, num_return_sequences, deadline=None, **generate_kwargs):
+    """
+    Generate several candidates for a prompt, with their scores.
+
+    Args:
+        model: The seq2seq model behind the pipeline
+        tokenizer: The model's tokenizer
+        text (str): The input prompt
+        num_return_sequences (int): Number of candidates to return
+        deadline (Deadline): Optional deadline; generation stops once it expires
+        **generate_kwargs: Generation parameters. Without sampling, beam search runs
+            with at least num_return_sequences beams
+
+    Returns:
+        list: One {"text", "score"} dict per candidate, best first
+
+    Raises:
+        DeadlineExceeded: If the deadline expired during generation
+    """
+    if not generate_kwargs.get("do_sample"):
+        generate_kwargs["num_beams"] = max(generate_kwargs.get("num_beams") or 1, num_return_sequences)
+    if deadline is not None:
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([DeadlineCriteria([deadline])])
+
+    inputs = tokenizer(text, return_tensors="pt", return_token_type_ids=False)
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            num_return_sequences=num_return_sequences,
+            return_dict_in_generate=True,
+            output_scores=True,
+            **generate_kwargs,
+        )
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded("Request deadline exceeded during generation")
+
+    # Beam search reports its own scores; sampling and greedy decoding don't
+    if getattr(outputs, "sequences_scores", None) is not None:
+        scores = outputs.sequences_scores.tolist()
+    else:
+        scores = _sequence_scores(model, outputs, generate_kwargs.get("length_penalty"))
+
+    texts = tokenizer.batch_decode(outputs.sequences, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    candidates = [{"text": text, "score": round(score, 4)} for text, score in zip(texts, scores)]
+    # Beams already come best first; samples are ranked the same way
+    candidates.sort(key=lambda candidate: candidate["score"], reverse=True)
+    return candidates
+
+
+def _sequence_scores(model, outputs, length_penalty=None):
+    """
+    Length-normalized log-probabilities of sampled or greedy sequences.
+
+    Args:
+        model: The model that generated the sequences
+        outputs: generate() output with the processed scores of every step
+        length_penalty (float): Exponent of the length normalization; the model's
+            generation config value when None
+
+    Returns:
+        list: One score per sequence
+    """
+    config = model.generation_config
+    if length_penalty is None:
+        length_penalty = config.length_penalty
+    log_probs = model.compute_transition_scores(outputs.sequences, outputs.scores, normalize_logits=True)
+
+    # Steps after a sequence's end-of-sequence token are padding, not part of it
+    generated = outputs.sequences[:, -log_probs.shape[1]:]
+    ended = (generated == config.eos_token_id).int()
+    inside = (ended.cumsum(dim=1) - ended) == 0
+    lengths = inside.sum(dim=1)
+    totals = log_probs.masked_fill(~inside, 0.0).sum(dim=1)
+    return (totals / lengths.clamp(min=1).float() ** length_penalty).tolist()
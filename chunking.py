@@ -0,0 +1,82 @@
+"""
+Splitting long inputs into chunks the model can read.
+
+flan-t5 was trained on inputs of up to 512 tokens; past that its output
+degrades, so a long document effectively only gets its beginning read.
+For long-document mode the document is split into overlapping chunks
+that each fit, every chunk gets the prompt's instruction ("Summarize:",
+"Answer the question: ...") repeated in front of it, and the chunks are
+generated for as one batch. The chunk outputs can then be combined with a
+second, reduce pass over them.
+
+Chunks are cut at token boundaries of the model's own tokenizer, mapped
+back to the original text, so no word is split and the text is not
+re-encoded.
+"""
+
+import re
+
+# A phrase of letters, digits, spaces and light punctuation ending in a letter and a colon,
+# followed by whitespace or the end of the text
+INSTRUCTION = re.compile(r"\s*([A-Za-z][\w ,'()/-]*?[A-Za-z]:)(?=\s|$)")
+
+
+def split_instruction(text, max_words=8):
+    """
+    Separate a prompt's leading instruction from the text it applies to.
+
+    The instruction is a short phrase at the start of the first line that ends in a
+    colon, e.g. "Summarize:" or "Translate English to German:". The colon must follow
+    a letter and be followed by whitespace, and the phrase may not contain sentence
+    punctuation, so times ("10:30"), URLs and ordinary sentences are not taken for one.
+
+    Args:
+        text (str): The prompt
+        max_words (int): Longest instruction recognized, in words
+
+    Returns:
+        tuple: (instruction including its colon, or "" if there is none; the rest of the text)
+    """
+    match = INSTRUCTION.match(text)
+    if match is None or len(match.group(1).split()) > max_words:
+        return "", text
+    return match.group(1), text[match.end():].strip()
+
+
+def chunk_text(tokenizer, text, chunk_tokens, overlap_tokens=0):
+    """
+    Split text into chunks of at most chunk_tokens tokens, consecutive chunks
+    sharing overlap_tokens tokens so nothing is cut off without context.
+
+    Args:
+        tokenizer: The model's tokenizer
+        text (str): The text to split
+        chunk_tokens (int): Maximum tokens per chunk, not counting special tokens
+        overlap_tokens (int): Tokens repeated at the start of each chunk from the end of the previous one
+
+    Returns:
+        list: The chunks, in order; the text itself if it fits in one chunk
+    """
+    chunk_tokens = max(1, int(chunk_tokens))
+    overlap_tokens = min(max(0, int(overlap_tokens)), chunk_tokens - 1)
+    if tokenizer.is_fast:
+        encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoding["offset_mapping"]
+    else:
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+        offsets = None
+    count = len(offsets) if offsets is not None else len(ids)
+    if count <= chunk_tokens:
+        return [text]
+
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + chunk_tokens, count)
+        if offsets is not None:
+            chunks.append(text[offsets[start][0]:offsets[end - 1][1]].strip())
+        else:
+            chunks.append(tokenizer.decode(ids[start:end]).strip())
+        if end == count:
+            return chunks
+        start = end - overlap_tokens
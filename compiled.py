@@ -0,0 +1,172 @@
+"""
+torch.compile mode for the PyTorch model.
+
+Eager PyTorch pays Python dispatch overhead on every operation of every
+decoder step. In compiled mode the encoder and decoder are compiled with
+torch.compile:
+
+- The encoder is compiled for a small set of static sequence lengths.
+  Inputs are padded up to the nearest length bucket; the padding is
+  masked, so the real positions' outputs are unchanged.
+- The decoder attends over the padded encoder output, so its
+  cross-attention length is always one of the buckets too. Its
+  self-attention cache grows by one position on every step, so that
+  dimension (and the batch size) is compiled as dynamic.
+
+Every bucket is compiled at startup, for greedy decoding and beam search,
+so no request pays for compilation. Call patterns the warm-up doesn't cover
+(other beam counts, teacher-forced scoring, restricted choices) run eagerly
+instead of compiling while a request waits.
+"""
+
+import time
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+class _Wrapper(torch.nn.Module):
+    """Module wrapper that forwards unknown attributes (embed_tokens, config, ...) to the wrapped module."""
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.eager, name)
+
+
+class BucketedEncoder(_Wrapper):
+    """
+    Runs a compiled encoder on inputs padded to a fixed set of lengths.
+
+    Args:
+        encoder (torch.nn.Module): The model's encoder
+        length_buckets (list): Sequence lengths the encoder is compiled for, ascending.
+            Longer inputs run through the eager encoder
+        pad_token_id (int): Token id used for padding
+    """
+
+    def __init__(self, encoder, length_buckets, pad_token_id=0):
+        super().__init__()
+        self.eager = encoder
+        self.compiled = torch.compile(encoder, dynamic=False)
+        self.length_buckets = sorted(int(length) for length in length_buckets)
+        self.pad_token_id = pad_token_id
+
+    def bucket(self, length):
+        """
+        Args:
+            length (int): Sequence length of an input
+
+        Returns:
+            int: The smallest bucket that fits it, or None if it is longer than all of them
+        """
+        for bucket in self.length_buckets:
+            if length <= bucket:
+                return bucket
+        return None
+
+    def forward(self, input_ids=None, attention_mask=None, inputs_embeds=None, **kwargs):
+        # Only plain token inputs go through the compiled graphs
+        plain = input_ids is not None and inputs_embeds is None and not kwargs.get("output_attentions") \
+            and not kwargs.get("output_hidden_states") and kwargs.get("head_mask") is None
+        length = input_ids.shape[1] if input_ids is not None else 0
+        bucket = self.bucket(length) if plain else None
+        if bucket is None:
+            return self.eager(input_ids=input_ids, attention_mask=attention_mask, inputs_embeds=inputs_embeds, **kwargs)
+
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        padding = bucket - length
+        if padding:
+            input_ids = torch.nn.functional.pad(input_ids, (0, padding), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (0, padding), value=0)
+
+        # Batch size varies with load, so only the sequence length is kept static
+        torch._dynamo.maybe_mark_dynamic(input_ids, 0)
+        torch._dynamo.maybe_mark_dynamic(attention_mask, 0)
+        outputs = self.compiled(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+        return BaseModelOutput(last_hidden_state=outputs.last_hidden_state)
+
+
+class PaddedCrossAttentionDecoder(_Wrapper):
+    """
+    Runs a compiled decoder against bucket-padded encoder outputs.
+
+    Generation keeps the caller's unpadded attention mask, so it is padded here
+    with zeros to the length of the encoder output, masking the extra positions.
+
+    Args:
+        decoder (torch.nn.Module): The model's decoder
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.eager = decoder
+        self.compiled = torch.compile(decoder, dynamic=True)
+
+    @staticmethod
+    def _pad_mask(encoder_hidden_states, encoder_attention_mask):
+        if encoder_hidden_states is not None and encoder_attention_mask is not None:
+            padding = encoder_hidden_states.shape[1] - encoder_attention_mask.shape[1]
+            if padding > 0:
+                encoder_attention_mask = torch.nn.functional.pad(encoder_attention_mask, (0, padding), value=0)
+        return encoder_attention_mask
+
+    def forward(self, encoder_hidden_states=None, encoder_attention_mask=None, **kwargs):
+        encoder_attention_mask = self._pad_mask(encoder_hidden_states, encoder_attention_mask)
+        return self.compiled(encoder_hidden_states=encoder_hidden_states, encoder_attention_mask=encoder_attention_mask, **kwargs)
+
+    def run_eager(self, encoder_hidden_states=None, encoder_attention_mask=None, **kwargs):
+        """Run the eager decoder, for call patterns that have no compiled graph."""
+        encoder_attention_mask = self._pad_mask(encoder_hidden_states, encoder_attention_mask)
+        return self.eager(encoder_hidden_states=encoder_hidden_states, encoder_attention_mask=encoder_attention_mask, **kwargs)
+
+
+def compile_model(model, length_buckets, warmup_batch_sizes=(1, 2), warmup_num_beams=(1, 2), generate=None):
+    """
+    Compile a seq2seq model's encoder and decoder and warm up every length bucket.
+
+    Args:
+        model: The T5 model; its encoder and decoder are replaced in place
+        length_buckets (list): Static sequence lengths the encoder is compiled for
+        warmup_batch_sizes (list): Batch sizes run for each bucket during warm-up,
+            so both the single-prompt and the batched graphs are ready
+        warmup_num_beams (list): Beam counts run for each bucket and batch size during warm-up
+        generate (callable): What serves requests, called like model.generate() to warm
+            up the graphs it will use; model.generate itself by default
+
+    Returns:
+        dict: Compile time per bucket and in total, in seconds
+    """
+    model.eval()
+    generate = generate or model.generate
+
+    # Each bucket, batch shape and decoder cache state is its own graph, and the encoder
+    # and decoder share T5Stack.forward, so allow all of them to be kept
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 16 * (len(length_buckets) + 2))
+
+    model.encoder = BucketedEncoder(model.encoder, length_buckets, pad_token_id=model.config.pad_token_id or 0)
+    model.decoder = PaddedCrossAttentionDecoder(model.decoder)
+
+    # Warm up: a short generation per bucket compiles the encoder graph for that
+    # length and the decoder graphs for the growing cache, with and without beams
+    # (beam search reorders the cache and runs more rows). The pipeline runs under
+    # no_grad, so warm up under it too (inference_mode tensors would not match its guards)
+    stats = {"buckets": {}}
+    started = time.perf_counter()
+    with torch.no_grad():
+        for bucket in model.encoder.length_buckets:
+            bucket_started = time.perf_counter()
+            for batch_size in warmup_batch_sizes:
+                input_ids = torch.full((batch_size, bucket), model.config.eos_token_id, dtype=torch.long)
+                for num_beams in warmup_num_beams:
+                    generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=8, num_beams=num_beams)
+            stats["buckets"][bucket] = round(time.perf_counter() - bucket_started, 2)
+    stats["total_seconds"] = round(time.perf_counter() - started, 2)
+
+    # Compiling a new graph takes many seconds and can't be interrupted, so a call the
+    # warm-up didn't cover would hold its inference worker while the request times out.
+    # Such calls run eagerly; the graphs compiled above are still used wherever they fit
+    torch.compiler.set_stance("eager_on_recompile")
+    return stats
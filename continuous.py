@@ -0,0 +1,419 @@
+"""
+Continuous (iteration-level) batching for the decoder.
+
+A static batch runs until its longest output is finished, so a short
+answer waits for the longest one it was batched with. The continuous
+batcher instead keeps one running batch of sequences and advances it a
+single decoder step at a time. Between steps it admits newly arrived
+prompts, running their encoder pass and adding them to the batch, and
+retires every sequence that has finished, so each request's latency
+depends on its own output length rather than its neighbours'.
+
+Sequences in the batch are at different decoder positions. Each one's
+self-attention keys and values are kept right-aligned, so every
+sequence's newest token is in the same cache column and the padding to
+its left is masked. T5's attention depends only on relative positions, so
+this decodes each sequence exactly as if it were alone. Cross-attention
+keys and values are computed once, when a sequence joins, and padded on
+the right to the longest prompt in the batch.
+
+Each step runs as its own task on the inference executor, so other model
+work (streaming, batch requests) is interleaved with decoding instead of
+waiting for the batch to drain. Beam search keeps several rows per prompt
+that are reordered every step, so those requests run on their own through
+the regular batch path instead.
+"""
+
+import collections
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+from transformers.cache_utils import DynamicCache, EncoderDecoderCache
+
+from deadlines import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class _Sequence:
+    """A prompt being decoded, along with the future its caller is waiting on."""
+
+    __slots__ = ("text", "options", "processors", "deadline", "future", "tokens")
+
+    def __init__(self, text, options, processors, deadline, future, start_token_id):
+        self.text = text
+        self.options = options
+        self.processors = processors
+        self.deadline = deadline
+        self.future = future
+        self.tokens = [start_token_id]
+
+
+class IterationStats:
+    """
+    Running statistics about decoder steps, used to tune the maximum batch size.
+
+    Args:
+        max_active (int): Maximum number of sequences decoded together
+    """
+
+    def __init__(self, max_active):
+        self._lock = threading.Lock()
+        self.max_active = max_active
+        self._steps = 0
+        self._rows = 0
+        self._admitted = 0
+        self._finished = 0
+        self._active = 0
+        self._waiting = 0
+
+    def record(self, rows, admitted, finished, waiting):
+        """
+        Record one decoder step.
+
+        Args:
+            rows (int): Sequences decoded in the step
+            admitted (int): Sequences that joined the batch before the step
+            finished (int): Sequences retired after the step
+            waiting (int): Prompts still waiting for a free slot
+        """
+        with self._lock:
+            self._steps += 1
+            self._rows += rows
+            self._admitted += admitted
+            self._finished += finished
+            self._active = rows - finished
+            self._waiting = waiting
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Step and sequence counts, the current batch, and the mean number of
+            sequences per step
+        """
+        with self._lock:
+            return {
+                "max_active": self.max_active,
+                "steps": self._steps,
+                "admitted": self._admitted,
+                "finished": self._finished,
+                "active": self._active,
+                "waiting": self._waiting,
+                "mean_batch_size": round(self._rows / self._steps, 2) if self._steps else 0.0,
+            }
+
+
+class ContinuousBatcher:
+    """
+    Decodes prompts from concurrent callers in one batch that changes every step.
+
+    Args:
+        engine (GenerationEngine): Provides the model, tokenizer and generation defaults
+        run_batch (callable): Runs beam search requests, called like MicroBatcher's
+            run_batch with a single prompt
+        max_active (int): Maximum number of sequences decoded together; further
+            prompts wait for a slot to free up
+        executor (InferenceExecutor): Executor the decoder steps run on. When omitted
+            steps run on the scheduler thread itself
+    """
+
+    def __init__(self, engine, run_batch, max_active=16, executor=None):
+        self.engine = engine
+        self.run_batch = run_batch
+        self.max_active = max(1, int(max_active))
+        self.executor = executor
+        self.stats = IterationStats(self.max_active)
+
+        config = engine.model.config
+        self.num_heads = config.num_heads
+        self.head_dim = config.d_kv
+
+        # New requests from callers, then the running batch; only the scheduler touches the latter
+        self._queue = queue.Queue()
+        self._waiting = collections.deque()
+        self._active = []
+        self._state = None
+
+        self._worker = threading.Thread(target=self._loop, name="continuous-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, deadline=None, **generate_kwargs):
+        """
+        Queue a prompt to join the running batch at the next step.
+
+        Args:
+            text (str): The input text/prompt
+            deadline (Deadline): Optional deadline after which the prompt is abandoned
+            **generate_kwargs: Generation parameters for this prompt
+
+        Returns:
+            Future: Resolves to the generated text for this prompt
+        """
+        options = self.engine.options(generate_kwargs)
+        if options["num_beams"] > 1:
+            return self._submit_alone(text, deadline, generate_kwargs)
+
+        future = Future()
+        processors = self.engine.processors(options)
+        self._queue.put(_Sequence(text, options, processors, deadline, future, self.engine.decoder_start_token_id))
+        return future
+
+    def _submit_alone(self, text, deadline, generate_kwargs):
+        """Run a request outside the running batch, as a batch of one."""
+
+        def run():
+            output = self.run_batch([text], deadlines=[deadline], **generate_kwargs)[0]
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded during generation")
+            return output
+
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(run())
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.executor.submit(run)
+
+    def _cross_attention(self, encoder_hidden_states):
+        """
+        Compute every decoder layer's cross-attention keys and values for new sequences.
+
+        Args:
+            encoder_hidden_states (torch.Tensor): Encoder output, shape (rows, length, d_model)
+
+        Returns:
+            list: A (keys, values) pair per decoder layer, each shaped (rows, heads, length, head_dim)
+        """
+        rows = encoder_hidden_states.shape[0]
+        pairs = []
+        for block in self.engine.model.decoder.block:
+            attention = block.layer[1].EncDecAttention
+            keys = attention.k(encoder_hidden_states).view(rows, -1, self.num_heads, self.head_dim).transpose(1, 2)
+            values = attention.v(encoder_hidden_states).view(rows, -1, self.num_heads, self.head_dim).transpose(1, 2)
+            pairs.append((keys, values))
+        return pairs
+
+    def _admit(self, sequences):
+        """
+        Run the encoder for new sequences and add them to the running batch.
+
+        Args:
+            sequences (list): Sequences joining the batch
+        """
+        model = self.engine.model
+        input_ids, encoder_mask = self.engine.encode([sequence.text for sequence in sequences])
+        encoder_hidden_states = model.encoder(
+            input_ids=input_ids, attention_mask=encoder_mask, return_dict=True
+        ).last_hidden_state
+        # A compiled encoder may return more positions than the prompt has; they are padding
+        encoder_mask = torch.nn.functional.pad(encoder_mask, (0, encoder_hidden_states.shape[1] - encoder_mask.shape[1]))
+        rows = len(sequences)
+
+        new = {
+            "encoder_hidden_states": encoder_hidden_states,
+            "encoder_mask": encoder_mask,
+            "cross": self._cross_attention(encoder_hidden_states),
+        }
+        if self._state is None:
+            new["self"] = [
+                (encoder_hidden_states.new_zeros((rows, self.num_heads, 0, self.head_dim)),) * 2
+                for layer in new["cross"]
+            ]
+            new["self_mask"] = encoder_mask.new_zeros((rows, 0))
+            self._state = new
+            self._active.extend(sequences)
+            return
+
+        # New sequences have nothing cached yet, so their self-attention columns are all padding
+        state = self._state
+        length = state["self_mask"].shape[1]
+        new["self"] = [
+            (keys.new_zeros((rows,) + keys.shape[1:]), values.new_zeros((rows,) + values.shape[1:]))
+            for keys, values in state["self"]
+        ]
+        new["self_mask"] = state["self_mask"].new_zeros((rows, length))
+
+        # Cross-attention is padded on the right to the longer of the two encoder lengths
+        source = max(state["encoder_mask"].shape[1], encoder_mask.shape[1])
+
+        def pad(tensor, dim):
+            missing = source - tensor.shape[dim]
+            if not missing:
+                return tensor
+            padding = [0, 0] * (tensor.dim() - dim - 1) + [0, missing]
+            return torch.nn.functional.pad(tensor, padding)
+
+        state["encoder_hidden_states"] = torch.cat(
+            [pad(state["encoder_hidden_states"], 1), pad(new["encoder_hidden_states"], 1)]
+        )
+        state["encoder_mask"] = torch.cat([pad(state["encoder_mask"], 1), pad(new["encoder_mask"], 1)])
+        state["cross"] = [
+            (torch.cat([pad(keys, 2), pad(new_keys, 2)]), torch.cat([pad(values, 2), pad(new_values, 2)]))
+            for (keys, values), (new_keys, new_values) in zip(state["cross"], new["cross"])
+        ]
+        state["self"] = [
+            (torch.cat([keys, new_keys]), torch.cat([values, new_values]))
+            for (keys, values), (new_keys, new_values) in zip(state["self"], new["self"])
+        ]
+        state["self_mask"] = torch.cat([state["self_mask"], new["self_mask"]])
+        self._active.extend(sequences)
+
+    def _retire(self, keep):
+        """
+        Drop finished sequences from the running batch and trim padding no sequence needs.
+
+        Args:
+            keep (list): Row indices of the sequences that continue
+        """
+        self._active = [self._active[row] for row in keep]
+        if not self._active:
+            self._state = None
+            return
+
+        state = self._state
+        # Each sequence has one cached position per token fed to the decoder so far
+        length = max(len(sequence.tokens) for sequence in self._active) - 1
+        rows = torch.tensor(keep, device=state["self_mask"].device)
+        state["self"] = [
+            (keys.index_select(0, rows)[:, :, -length:], values.index_select(0, rows)[:, :, -length:])
+            for keys, values in state["self"]
+        ]
+        state["self_mask"] = state["self_mask"].index_select(0, rows)[:, -length:]
+        state["encoder_hidden_states"] = state["encoder_hidden_states"].index_select(0, rows)
+        state["encoder_mask"] = state["encoder_mask"].index_select(0, rows)
+        state["cross"] = [
+            (keys.index_select(0, rows), values.index_select(0, rows)) for keys, values in state["cross"]
+        ]
+
+    def _select(self, logits):
+        """
+        Pick the next token of every sequence, applying each one's own processors.
+
+        Args:
+            logits (torch.Tensor): Next-token logits, one row per active sequence
+
+        Returns:
+            list: The chosen token id for each sequence
+        """
+        tokens = torch.argmax(logits, dim=-1).tolist()
+        for row, sequence in enumerate(self._active):
+            if not sequence.processors and not sequence.options["do_sample"]:
+                continue
+            input_ids = torch.tensor([sequence.tokens], device=logits.device)
+            scores = sequence.processors(input_ids, logits[row:row + 1])
+            if sequence.options["do_sample"]:
+                tokens[row] = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).item()
+            else:
+                tokens[row] = torch.argmax(scores, dim=-1).item()
+        return tokens
+
+    @torch.no_grad()
+    def _iterate(self, arrivals):
+        """
+        Admit new sequences, run one decoder step over the batch, and retire finished sequences.
+
+        Args:
+            arrivals (list): Sequences that may join the batch before this step
+
+        Returns:
+            int: Number of sequences still running
+        """
+        # Skip callers that have already given up
+        admitted = []
+        for sequence in arrivals:
+            if not sequence.future.set_running_or_notify_cancel():
+                continue
+            if sequence.deadline is not None and sequence.deadline.expired():
+                sequence.future.set_exception(DeadlineExceeded("Request deadline exceeded before it was scheduled"))
+                continue
+            admitted.append(sequence)
+        if admitted:
+            try:
+                self._admit(admitted)
+            except Exception as e:
+                for sequence in admitted:
+                    sequence.future.set_exception(e)
+        if not self._active:
+            return 0
+
+        state = self._state
+        length = state["self_mask"].shape[1]
+        attention_mask = torch.cat([state["self_mask"], state["self_mask"].new_ones((len(self._active), 1))], dim=1)
+        cache = EncoderDecoderCache(
+            DynamicCache.from_legacy_cache(tuple(state["self"])),
+            DynamicCache.from_legacy_cache(tuple(state["cross"])),
+        )
+        last = torch.tensor([sequence.tokens[-1] for sequence in self._active], device=attention_mask.device)
+        try:
+            logits = self.engine.step(
+                last, length, cache, state["encoder_hidden_states"], state["encoder_mask"], attention_mask=attention_mask
+            )
+            tokens = self._select(logits)
+        except Exception as e:
+            # A failed step fails every sequence in the batch
+            for sequence in self._active:
+                sequence.future.set_exception(e)
+            self._active = []
+            self._state = None
+            return 0
+
+        self_attention = cache.self_attention_cache
+        state["self"] = list(zip(self_attention.key_cache, self_attention.value_cache))
+        state["self_mask"] = attention_mask
+
+        keep = []
+        for row, (sequence, token) in enumerate(zip(self._active, tokens)):
+            sequence.tokens.append(token)
+            generated = len(sequence.tokens) - 1
+            if sequence.deadline is not None and sequence.deadline.expired():
+                # A sequence cut short by its deadline is not a valid result
+                sequence.future.set_exception(DeadlineExceeded("Request deadline exceeded during generation"))
+            elif token == self.engine.eos_token_id or generated >= sequence.options["max_new_tokens"]:
+                sequence.future.set_result(self.engine.tokenizer.decode(
+                    sequence.tokens, skip_special_tokens=True, clean_up_tokenization_spaces=False
+                ))
+            else:
+                keep.append(row)
+
+        rows = len(self._active)
+        if len(keep) < rows:
+            self._retire(keep)
+        self.stats.record(rows, len(admitted), rows - len(keep), len(self._waiting))
+        return len(self._active)
+
+    def _loop(self):
+        while True:
+            # Wait for work only when nothing is being decoded
+            if not self._active and not self._waiting:
+                self._waiting.append(self._queue.get())
+
+            # Pick up everything that arrived during the last step
+            while True:
+                try:
+                    self._waiting.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            arrivals = []
+            while self._waiting and len(self._active) + len(arrivals) < self.max_active:
+                arrivals.append(self._waiting.popleft())
+
+            try:
+                if self.executor is None:
+                    self._iterate(arrivals)
+                else:
+                    self.executor.submit(self._iterate, arrivals).result()
+            except Exception as e:
+                # A failed iteration fails every sequence it touched, but the scheduler has to
+                # keep running or every later request would wait forever
+                sequences = [sequence for sequence in self._active + arrivals if not sequence.future.done()]
+                logger.exception("Continuous batching step failed, %d sequences dropped", len(sequences))
+                for sequence in sequences:
+                    sequence.future.set_exception(e)
+                self._active = []
+                self._state = None
@@ -0,0 +1,142 @@
+"""
+Per-request deadlines that stop generation mid-decode.
+
+Each piece of model work carries a Deadline. Waiting requests give up on
+their own once their time runs out or their client disconnects, and
+cancel their share of the deadline as they leave. A stopping criterion
+checks the deadline between decoder steps, so once nobody is waiting for
+a sequence any more the model stops extending it and the CPU is freed
+for live requests.
+"""
+
+import asyncio
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes, or its client goes away, before the result is ready."""
+
+
+class Deadline:
+    """
+    Tracks whether anybody still wants the result of a piece of work.
+
+    Several requests can wait on the same work (see SingleFlight). The work is
+    only abandoned once every one of them has cancelled, or the latest of
+    their expiry times has passed. Once expired, a deadline stays expired.
+
+    Args:
+        timeout (float): Seconds the first waiter is willing to wait. None waits forever
+    """
+
+    def __init__(self, timeout=None):
+        self._lock = threading.Lock()
+        self._waiters = 1
+        self._cancelled = 0
+        self._expired = False
+        self._expires_at = None if timeout is None else time.monotonic() + timeout
+
+    def join(self, timeout=None):
+        """
+        Add another waiter, extending the expiry time if it is willing to wait longer.
+
+        Args:
+            timeout (float): Seconds the new waiter is willing to wait. None waits forever
+
+        Returns:
+            bool: False if the deadline had already expired, in which case the work
+            may have been cut short and the waiter should not rely on it
+        """
+        with self._lock:
+            if self._check():
+                return False
+            self._waiters += 1
+            if self._expires_at is not None:
+                self._expires_at = None if timeout is None else max(self._expires_at, time.monotonic() + timeout)
+            return True
+
+    def cancel(self):
+        """Record that one waiter has given up."""
+        with self._lock:
+            self._cancelled += 1
+
+    def expired(self):
+        """
+        Returns:
+            bool: Whether every waiter has given up or the expiry time has passed
+        """
+        with self._lock:
+            return self._check()
+
+    def _check(self):
+        """Latch and report expiry. The caller must hold the lock."""
+        if not self._expired:
+            self._expired = self._cancelled >= self._waiters or (
+                self._expires_at is not None and time.monotonic() >= self._expires_at
+            )
+        return self._expired
+
+
+class DeadlineCriteria(StoppingCriteria):
+    """
+    Stopping criterion that ends each sequence once its deadline has expired.
+
+    Args:
+        deadlines (list): One Deadline (or None) per input in the batch
+    """
+
+    def __init__(self, deadlines):
+        self.deadlines = deadlines
+
+    def __call__(self, input_ids, scores, **kwargs):
+        expired = [deadline is not None and deadline.expired() for deadline in self.deadlines]
+        done = torch.tensor(expired, dtype=torch.bool, device=input_ids.device)
+        # Each input's rows are contiguous: one per beam, or per beam search candidate
+        rows_per_input = max(1, input_ids.shape[0] // len(self.deadlines))
+        return done.repeat_interleave(rows_per_input)
+
+
+async def wait_for_result(future, deadline, timeout=None, is_disconnected=None, poll_interval=0.1):
+    """
+    Wait for a model result on behalf of one request.
+
+    The shared future is never cancelled directly; instead the request cancels
+    its share of the deadline when it stops waiting, so the work itself only
+    stops once nobody else is waiting for it either.
+
+    Args:
+        future (concurrent.futures.Future): The pending model result
+        deadline (Deadline): The work's deadline, which this request has joined
+        timeout (float): Seconds this request is willing to wait. None waits forever
+        is_disconnected (callable): Coroutine function reporting whether the client has gone away
+        poll_interval (float): Seconds between client disconnect checks
+
+    Returns:
+        The result of the future
+
+    Raises:
+        DeadlineExceeded: If the timeout passes or the client disconnects first
+    """
+    # asyncio.wait never cancels what it waits on, so the shared future is left running
+    waiter = asyncio.wrap_future(future)
+    expires_at = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            wait = poll_interval if expires_at is None else min(poll_interval, expires_at - time.monotonic())
+            done, _ = await asyncio.wait({waiter}, timeout=max(0.0, wait))
+            if done:
+                return waiter.result()
+            if expires_at is not None and time.monotonic() >= expires_at:
+                raise DeadlineExceeded("Request deadline exceeded")
+            if is_disconnected is not None and await is_disconnected():
+                raise DeadlineExceeded("Client disconnected")
+    except BaseException:
+        if not waiter.done():
+            deadline.cancel()
+            # Nobody will read the eventual outcome, so retrieve it to keep asyncio quiet
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+        raise
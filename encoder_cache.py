@@ -0,0 +1,151 @@
+"""
+Cache of encoder outputs for repeated inputs.
+
+Clients often send the same input again with different generation
+parameters: another max_new_tokens, more beams, or sampling instead of
+greedy decoding. The response cache can't help with those, but the
+encoder pass is the same every time, since it only depends on the input
+tokens. EncoderCache wraps the model's encoder and keeps each input's
+hidden states, keyed by its token ids, so only inputs it hasn't seen are
+encoded. Batches are split per input: cached rows are reused and the rest
+are encoded together.
+
+Entries are bounded by their total size in bytes and evicted least
+recently used first.
+"""
+
+import collections
+import threading
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+class EncoderCache(torch.nn.Module):
+    """
+    Encoder wrapper that reuses the hidden states of inputs it has encoded before.
+
+    Args:
+        encoder (torch.nn.Module): The model's encoder, possibly already compiled
+        max_bytes (int): Maximum total size of the cached hidden states and keys
+    """
+
+    def __init__(self, encoder, max_bytes=64 * 1024 * 1024):
+        super().__init__()
+        self.eager = encoder
+        self.max_bytes = max(0, int(max_bytes))
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        # Forward unknown attributes (embed_tokens, config, ...) to the wrapped encoder
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.eager, name)
+
+    @staticmethod
+    def _size(key, value):
+        return value.numel() * value.element_size() + len(key) * 8
+
+    def _output_length(self, length):
+        """Length the assembled output is padded to; a compiled encoder's bucket when it has one."""
+        bucket = getattr(self.eager, "bucket", None)
+        return (bucket(length) if bucket is not None else None) or length
+
+    def forward(self, input_ids=None, attention_mask=None, inputs_embeds=None, **kwargs):
+        # Only plain token inputs are cached, and only right-padded ones, whose tokens are a prefix
+        plain = input_ids is not None and inputs_embeds is None and kwargs.get("return_dict") is not False \
+            and not kwargs.get("output_attentions") and not kwargs.get("output_hidden_states") \
+            and kwargs.get("head_mask") is None
+        if plain and attention_mask is not None:
+            lengths = attention_mask.sum(dim=1).tolist()
+            plain = all(attention_mask[row, :length].all() for row, length in enumerate(lengths))
+        else:
+            lengths = [input_ids.shape[1]] * input_ids.shape[0] if plain else []
+        if not plain or not self.max_bytes:
+            return self.eager(input_ids=input_ids, attention_mask=attention_mask, inputs_embeds=inputs_embeds, **kwargs)
+
+        keys = [tuple(input_ids[row, :length].tolist()) for row, length in enumerate(lengths)]
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        # Encode each distinct missing input once, as one batch
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            rows = [keys.index(key) for key in missing]
+            length = max(len(key) for key in missing)
+            index = torch.tensor(rows, device=input_ids.device)
+            outputs = self.eager(
+                input_ids=input_ids.index_select(0, index)[:, :length],
+                attention_mask=attention_mask.index_select(0, index)[:, :length] if attention_mask is not None else None,
+                return_dict=True,
+            )
+            hidden = outputs.last_hidden_state
+            with self._lock:
+                for row, key in enumerate(missing):
+                    # Copy, so an entry doesn't keep the whole batch's output alive
+                    found[key] = hidden[row, :len(key)].detach().clone()
+                    self._store(key, found[key])
+
+            # Nothing was cached: the encoder's own output has the right shape already
+            if len(missing) == len(keys) and length == input_ids.shape[1]:
+                return BaseModelOutput(last_hidden_state=hidden)
+
+        # Assemble the batch, leaving the padding positions (masked in cross-attention) zero
+        first = found[keys[0]]
+        hidden = first.new_zeros((len(keys), self._output_length(input_ids.shape[1]), first.shape[-1]))
+        for row, key in enumerate(keys):
+            hidden[row, :len(key)] = found[key]
+        return BaseModelOutput(last_hidden_state=hidden)
+
+    def _store(self, key, value):
+        """
+        Insert an entry and evict down to the byte bound. The caller must hold the lock.
+
+        Args:
+            key (tuple): Token ids of the input
+            value (torch.Tensor): Its hidden states, shape (length, d_model)
+        """
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= self._size(key, previous)
+        self._entries[key] = value
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_value)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count, size in bytes, and hit/miss/eviction counters with the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,710 @@
+"""
+Lean generation engine for T5-style encoder-decoder models.
+
+The transformers pipeline and model.generate() are written for every model
+and every decoding strategy, so each call re-resolves the generation config,
+validates arguments, builds logits processors and stopping criteria and
+post-processes generically. For the one model this app serves that work is
+pure overhead on short prompts. The engine instead:
+
+- tokenizes the batch once and runs the encoder once,
+- keeps the decoder's self-attention keys/values in a cache preallocated
+  for the whole generation, so no step reallocates or concatenates it, and
+  computes the cross-attention keys/values on the first step only,
+- drives the decoder one token at a time with its own greedy, sampling or
+  beam search loop, building only the logits processors a request needs.
+
+Optionally, greedy decoding of a single prompt is sped up with prompt
+lookup: when the last few generated tokens also occur in the input, the
+tokens that follow them there are proposed as a draft, and one decoder
+forward over the draft checks all of it. The longest prefix that greedy
+decoding would have produced anyway is kept, plus the token the model
+predicts after it, so the output is unchanged while copy-heavy tasks
+(rewriting, grammar fixes, extraction) need far fewer decoder forwards.
+
+It is called exactly like the text2text-generation pipeline, so batching,
+deadlines and the endpoints work unchanged, and with the same parameters it
+produces the same text as the pipeline.
+"""
+
+import threading
+
+import torch
+from transformers import (
+    GenerationConfig,
+    LogitsProcessorList,
+    MinNewTokensLengthLogitsProcessor,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+from transformers.cache_utils import Cache, DynamicCache, EncoderDecoderCache
+
+
+class PreallocatedCache(Cache):
+    """
+    Decoder self-attention cache whose buffers are allocated once per generation.
+
+    Each step writes its keys and values into the next free position in place,
+    where DynamicCache would concatenate and copy the whole cache, and attention
+    sees only the filled part, so no masking of unused positions is needed.
+
+    Args:
+        layers (int): Number of decoder layers
+        rows (int): Number of sequences decoded together
+        heads (int): Attention heads per layer
+        head_dim (int): Size of each head's keys and values
+        length (int): Maximum number of decoder positions
+        like (torch.Tensor): Tensor whose device and dtype the buffers use
+    """
+
+    def __init__(self, layers, rows, heads, head_dim, length, like):
+        super().__init__()
+        shape = (rows, heads, length, head_dim)
+        self.key_cache = [like.new_zeros(shape) for layer in range(layers)]
+        self.value_cache = [like.new_zeros(shape) for layer in range(layers)]
+        self.lengths = [0] * layers
+
+    def update(self, key_states, value_states, layer_idx, cache_kwargs=None):
+        start = self.lengths[layer_idx]
+        end = start + key_states.shape[-2]
+        self.key_cache[layer_idx][:, :, start:end] = key_states
+        self.value_cache[layer_idx][:, :, start:end] = value_states
+        self.lengths[layer_idx] = end
+        return self.key_cache[layer_idx][:, :, :end], self.value_cache[layer_idx][:, :, :end]
+
+    def get_seq_length(self, layer_idx=0):
+        return self.lengths[layer_idx]
+
+    def get_max_cache_shape(self):
+        return self.key_cache[0].shape[2]
+
+    def crop(self, length):
+        # Positions past length are overwritten by the next update
+        self.lengths = [min(length, current) for current in self.lengths]
+
+    def reorder_cache(self, beam_idx):
+        # Only the filled positions need to move with their beams
+        for layer_idx, length in enumerate(self.lengths):
+            for cache in (self.key_cache, self.value_cache):
+                cache[layer_idx][:, :, :length] = cache[layer_idx][:, :, :length].index_select(0, beam_idx)
+
+
+class GenerationEngine:
+    """
+    Generates text with a T5 model behind the same call signature as a
+    text2text-generation pipeline.
+
+    Args:
+        model: The T5ForConditionalGeneration model
+        tokenizer: The model's tokenizer
+        generation_config (GenerationConfig): Generation defaults; the model's own when omitted
+        lookup_tokens (int): Maximum number of draft tokens proposed from the prompt per
+            decoder forward in greedy decoding of a single prompt. 0 disables prompt lookup
+        lookup_ngram (int): Longest run of generated tokens matched against the prompt
+    """
+
+    def __init__(self, model, tokenizer, generation_config=None, lookup_tokens=0, lookup_ngram=3):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.generation_config = generation_config or model.generation_config
+        self.lookup_tokens = max(0, int(lookup_tokens))
+        self.lookup_ngram = max(1, int(lookup_ngram))
+        self._lookup_lock = threading.Lock()
+        self._lookup_counts = {"generations": 0, "tokens": 0, "forwards": 0, "drafted": 0, "accepted": 0}
+
+        config = model.config
+        self.decoder_start_token_id = config.decoder_start_token_id
+        self.eos_token_id = self.generation_config.eos_token_id
+        self.pad_token_id = self.generation_config.pad_token_id
+        if self.pad_token_id is None:
+            self.pad_token_id = config.pad_token_id
+
+        # T5 scales the decoder output before a tied LM head
+        self.output_scale = config.d_model ** -0.5 if config.tie_word_embeddings else None
+
+    def options(self, generate_kwargs):
+        """
+        Resolve generation parameters against the generation config.
+
+        Args:
+            generate_kwargs (dict): Generation parameters as accepted by the pipeline
+
+        Returns:
+            dict: Every parameter the decoding loops use
+        """
+        config = self.generation_config
+
+        def get(name):
+            value = generate_kwargs.get(name)
+            return getattr(config, name) if value is None else value
+
+        max_new_tokens = get("max_new_tokens")
+        if not max_new_tokens:
+            # max_length counts the decoder start token, except that generate() always
+            # allows 20 new tokens when it is left at its default
+            default = config.max_length == GenerationConfig().max_length
+            max_new_tokens = config.max_length if default else config.max_length - 1
+        return {
+            "max_new_tokens": max_new_tokens,
+            "min_new_tokens": get("min_new_tokens") or 0,
+            "num_beams": get("num_beams") or 1,
+            "do_sample": bool(get("do_sample")),
+            "temperature": get("temperature"),
+            "top_k": get("top_k"),
+            "top_p": get("top_p"),
+            "repetition_penalty": get("repetition_penalty"),
+            "no_repeat_ngram_size": get("no_repeat_ngram_size"),
+            "length_penalty": get("length_penalty"),
+            "early_stopping": get("early_stopping"),
+        }
+
+    def processors(self, options):
+        """
+        Build the logits processors a request needs, in the order generate() applies them.
+
+        Args:
+            options (dict): Resolved generation parameters
+
+        Returns:
+            LogitsProcessorList: The processors, often empty
+        """
+        processors = LogitsProcessorList()
+        if options["repetition_penalty"] is not None and options["repetition_penalty"] != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(penalty=options["repetition_penalty"]))
+        if options["no_repeat_ngram_size"]:
+            processors.append(NoRepeatNGramLogitsProcessor(options["no_repeat_ngram_size"]))
+        if options["min_new_tokens"]:
+            # The decoder prompt is the start token alone
+            processors.append(MinNewTokensLengthLogitsProcessor(1, options["min_new_tokens"], self.eos_token_id))
+        if options["do_sample"]:
+            # Beam search needs at least one token besides EOS to continue with
+            keep = 2 if options["num_beams"] > 1 else 1
+            if options["temperature"] is not None and options["temperature"] != 1.0:
+                processors.append(TemperatureLogitsWarper(options["temperature"]))
+            if options["top_k"]:
+                processors.append(TopKLogitsWarper(top_k=options["top_k"], min_tokens_to_keep=keep))
+            if options["top_p"] is not None and options["top_p"] < 1.0:
+                processors.append(TopPLogitsWarper(top_p=options["top_p"], min_tokens_to_keep=keep))
+        return processors
+
+    def _new_cache(self, rows, length, like):
+        """
+        Args:
+            rows (int): Number of sequences decoded together
+            length (int): Maximum number of decoder positions
+            like (torch.Tensor): Tensor whose device and dtype the cache uses
+
+        Returns:
+            EncoderDecoderCache: A preallocated self-attention cache and an empty cross-attention cache
+        """
+        config = self.model.config
+        self_attention = PreallocatedCache(config.num_decoder_layers, rows, config.num_heads, config.d_kv, length, like)
+        return EncoderDecoderCache(self_attention, DynamicCache())
+
+    def step(self, tokens, position, cache, encoder_hidden_states, encoder_attention_mask, attention_mask=None):
+        """
+        Run the decoder for one position of every sequence.
+
+        Args:
+            tokens (torch.Tensor): The latest token of each sequence, shape (rows,)
+            position (int): Cache column the tokens' keys and values are written to
+            cache (EncoderDecoderCache): The sequences' cache, updated in place
+            encoder_hidden_states (torch.Tensor): Encoder output for each sequence
+            encoder_attention_mask (torch.Tensor): Encoder padding mask for each sequence
+            attention_mask (torch.Tensor): Mask over the cached positions and the new one,
+                for caches that hold padding. All positions are attended when omitted
+
+        Returns:
+            torch.Tensor: Next-token logits, shape (rows, vocab_size)
+        """
+        return self.decode(
+            tokens[:, None], position, cache, encoder_hidden_states, encoder_attention_mask, attention_mask
+        )[:, -1]
+
+    def decode(self, tokens, position, cache, encoder_hidden_states, encoder_attention_mask, attention_mask=None,
+               vocabulary=None, eager=False):
+        """
+        Run the decoder for several consecutive positions of every sequence at once.
+
+        Args:
+            tokens (torch.Tensor): The sequences' next tokens, shape (rows, count)
+            position (int): Cache column the first token's keys and values are written to
+            cache (EncoderDecoderCache): The sequences' cache, updated in place
+            encoder_hidden_states (torch.Tensor): Encoder output for each sequence
+            encoder_attention_mask (torch.Tensor): Encoder padding mask for each sequence
+            attention_mask (torch.Tensor): Mask over the cached positions and the new ones,
+                for caches that hold padding. All positions are attended when omitted
+            vocabulary (torch.Tensor): Token ids to compute logits for; the whole vocabulary
+                when omitted
+            eager (bool): Bypass a compiled decoder, for call patterns compile_model()
+                doesn't warm up
+
+        Returns:
+            torch.Tensor: Logits for the token after each of them, shape (rows, count, vocab_size),
+            or (rows, count, len(vocabulary)) with a vocabulary
+        """
+        count = tokens.shape[1]
+        decoder = self._eager_decoder() if eager else self.model.decoder
+        outputs = decoder(
+            input_ids=tokens.contiguous(),
+            attention_mask=attention_mask,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=cache,
+            cache_position=torch.arange(position, position + count, device=tokens.device),
+            use_cache=True,
+            return_dict=True,
+        )
+        hidden = outputs.last_hidden_state
+        if self.output_scale is not None:
+            hidden = hidden * self.output_scale
+        if vocabulary is None:
+            return self.model.lm_head(hidden).float()
+
+        # Only the LM head rows of the allowed tokens are multiplied; a quantized head
+        # keeps its weights packed, so it computes every logit and the allowed ones are picked
+        weight = self.model.lm_head.weight
+        if not isinstance(weight, torch.Tensor):
+            return self.model.lm_head(hidden)[..., vocabulary].float()
+        return torch.nn.functional.linear(hidden, weight.index_select(0, vocabulary)).float()
+
+    def _search(self, encoder_hidden_states, encoder_attention_mask, options, processors, stopping_criteria):
+        """
+        Greedy or sampled decoding of one token per sequence per step.
+
+        Returns:
+            torch.Tensor: The generated ids, starting with the decoder start token
+        """
+        rows = encoder_hidden_states.shape[0]
+        max_new_tokens = options["max_new_tokens"]
+        device = encoder_hidden_states.device
+
+        cache = self._new_cache(rows, max_new_tokens, encoder_hidden_states)
+        sequences = torch.full((rows, 1), self.decoder_start_token_id, dtype=torch.long, device=device)
+        unfinished = torch.ones(rows, dtype=torch.bool, device=device)
+
+        for position in range(max_new_tokens):
+            logits = self.step(sequences[:, -1], position, cache, encoder_hidden_states, encoder_attention_mask)
+            scores = processors(sequences, logits)
+            if options["do_sample"]:
+                tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                tokens = torch.argmax(scores, dim=-1)
+            # Finished sequences are padded until the whole batch is done
+            tokens = torch.where(unfinished, tokens, self.pad_token_id)
+            sequences = torch.cat([sequences, tokens[:, None]], dim=-1)
+
+            unfinished &= tokens != self.eos_token_id
+            if stopping_criteria:
+                unfinished &= ~stopping_criteria(sequences, scores)
+            if not unfinished.any():
+                break
+        return sequences
+
+    def _lookup_table(self, prompt):
+        """
+        Index where each short run of prompt tokens first occurs.
+
+        Args:
+            prompt (list): The prompt's token ids
+
+        Returns:
+            dict: For every run of up to lookup_ngram tokens, the index just after its first occurrence
+        """
+        table = {}
+        for size in range(1, self.lookup_ngram + 1):
+            for end in range(size, len(prompt)):
+                table.setdefault(tuple(prompt[end - size:end]), end)
+        return table
+
+    def _lookup_search(self, prompt, encoder_hidden_states, encoder_attention_mask, options, processors, stopping_criteria):
+        """
+        Greedy decoding of one prompt that verifies drafts copied from the prompt.
+
+        Each decoder forward runs the latest token followed by the draft. Its logits
+        at every position are what single steps would have computed, so the draft is
+        kept up to its first token that greedy decoding would not have picked, and
+        the model's own pick there is appended too. The cache is cut back to the
+        tokens kept, so the rejected part of the draft is overwritten next.
+
+        Args:
+            prompt (list): The prompt's token ids, drafts are copied from
+
+        Returns:
+            torch.Tensor: The generated ids, starting with the decoder start token
+        """
+        max_new_tokens = options["max_new_tokens"]
+        device = encoder_hidden_states.device
+        table = self._lookup_table(prompt)
+
+        cache = self._new_cache(1, max_new_tokens, encoder_hidden_states)
+        generated = [self.decoder_start_token_id]
+        forwards = drafted = accepted = 0
+        done = False
+        while not done:
+            # Draft what followed the longest run of recent tokens found in the prompt
+            position = len(generated) - 1
+            room = min(self.lookup_tokens, max_new_tokens - position - 1)
+            draft = []
+            for size in range(min(self.lookup_ngram, len(generated)), 0, -1):
+                start = table.get(tuple(generated[-size:]))
+                if start is not None:
+                    draft = prompt[start:start + room]
+                    break
+
+            tokens = torch.tensor([generated[-1:] + draft], device=device)
+            logits = self.decode(tokens, position, cache, encoder_hidden_states, encoder_attention_mask)[0]
+            forwards += 1
+            drafted += len(draft)
+
+            # Processors depend on the tokens before each position, so they are applied one position at a time
+            if processors:
+                picks = []
+                for index in range(len(draft) + 1):
+                    sequence = torch.tensor([generated + draft[:index]], device=device)
+                    picks.append(int(torch.argmax(processors(sequence, logits[index:index + 1]), dim=-1)))
+                    if index < len(draft) and picks[-1] != draft[index]:
+                        break
+            else:
+                picks = torch.argmax(logits, dim=-1).tolist()
+
+            for index, token in enumerate(picks):
+                generated.append(token)
+                matched = index < len(draft) and token == draft[index]
+                accepted += matched
+                if token == self.eos_token_id or len(generated) - 1 >= max_new_tokens:
+                    done = True
+                    break
+                if not matched:
+                    break
+            cache.self_attention_cache.crop(len(generated) - 1)
+
+            if stopping_criteria and not done:
+                sequences = torch.tensor([generated], device=device)
+                done = bool(stopping_criteria(sequences, None).all())
+
+        with self._lookup_lock:
+            counts = self._lookup_counts
+            counts["generations"] += 1
+            counts["tokens"] += len(generated) - 1
+            counts["forwards"] += forwards
+            counts["drafted"] += drafted
+            counts["accepted"] += accepted
+        return torch.tensor([generated], device=device)
+
+    def _eager_decoder(self):
+        """
+        Returns:
+            callable: The model's decoder without torch.compile, called like the decoder itself
+        """
+        return getattr(self.model.decoder, "run_eager", self.model.decoder)
+
+    @torch.no_grad()
+    def choose(self, text, choices, stopping_criteria=None):
+        """
+        Greedy decoding restricted to a fixed set of allowed outputs.
+
+        The allowed outputs' token ids form a prefix tree. Each step only computes the
+        logits of the tokens that continue one of them, and positions where just one
+        token can follow need no decoder forward of their own: they are fed together
+        with the next position that has a choice to make.
+
+        Args:
+            text (str): The input prompt
+            choices (list): The allowed outputs
+            stopping_criteria (StoppingCriteriaList): Extra criteria, e.g. deadlines,
+                checked after each decoder forward
+
+        Returns:
+            str: The chosen output, exactly as given in choices, or None if the
+            stopping criteria ended decoding first
+        """
+        targets = {}
+        for choice, ids in zip(choices, self.tokenizer(list(choices), return_token_type_ids=False)["input_ids"]):
+            targets.setdefault(tuple(ids), choice)
+
+        input_ids, attention_mask = self.encode([text])
+        encoder_hidden_states = self.model.encoder(
+            input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+        ).last_hidden_state
+        cache = self._new_cache(1, max(len(target) for target in targets), encoder_hidden_states)
+
+        generated = [self.decoder_start_token_id]
+        position = 0
+        while True:
+            prefix = tuple(generated[1:])
+            if prefix in targets:
+                return targets[prefix]
+            allowed = sorted({target[len(prefix)] for target in targets if target[:len(prefix)] == prefix})
+            if len(allowed) == 1:
+                generated.append(allowed[0])
+                continue
+
+            vocabulary = torch.tensor(allowed, device=input_ids.device)
+            tokens = torch.tensor([generated[position:]], device=input_ids.device)
+            # Feeding several tokens at once is a call shape compiled mode has no graph for
+            logits = self.decode(
+                tokens, position, cache, encoder_hidden_states, attention_mask, vocabulary=vocabulary, eager=True
+            )[:, -1]
+            position = len(generated)
+            generated.append(allowed[int(torch.argmax(logits, dim=-1))])
+            if stopping_criteria and bool(stopping_criteria(torch.tensor([generated]), None).all()):
+                return None
+
+    @torch.no_grad()
+    def embed(self, texts, normalize=False):
+        """
+        Embed prompts as the mean of their encoder hidden states.
+
+        Args:
+            texts (list): The prompts
+            normalize (bool): Scale every vector to unit length
+
+        Returns:
+            torch.Tensor: One float32 vector per prompt, shape (len(texts), d_model)
+        """
+        input_ids, attention_mask = self.encode(texts)
+        hidden = self.model.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=True).last_hidden_state
+        # A compiled encoder may return more positions than the prompts have; they are padding
+        mask = torch.nn.functional.pad(attention_mask, (0, hidden.shape[1] - attention_mask.shape[1]))
+        mask = mask[:, :, None].to(hidden.dtype)
+        vectors = ((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)).float()
+        return torch.nn.functional.normalize(vectors, dim=-1) if normalize else vectors
+
+    @torch.no_grad()
+    def score(self, text, candidates):
+        """
+        Log-likelihood of each candidate output for a prompt, from one teacher-forced pass.
+
+        The prompt is encoded once and every candidate attends over the same encoder
+        output, so the cost is a single decoder forward over the padded candidates
+        instead of a generation per candidate.
+
+        Args:
+            text (str): The input prompt
+            candidates (list): The candidate outputs
+
+        Returns:
+            list: (log-likelihood, token count) per candidate, including its end-of-sequence token
+        """
+        input_ids, attention_mask = self.encode([text])
+        encoder_hidden_states = self.model.encoder(
+            input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+        ).last_hidden_state
+
+        # Targets are right-padded; the decoder is causal, so padding never affects the real positions
+        targets = self.tokenizer(list(candidates), return_token_type_ids=False)["input_ids"]
+        rows, length = len(targets), max(len(target) for target in targets)
+        labels = torch.full((rows, length), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((rows, length), dtype=torch.bool)
+        for row, target in enumerate(targets):
+            labels[row, :len(target)] = torch.tensor(target)
+            mask[row, :len(target)] = True
+        labels, mask = labels.to(input_ids.device), mask.to(input_ids.device)
+        decoder_input_ids = torch.cat([torch.full_like(labels[:, :1], self.decoder_start_token_id), labels[:, :-1]], dim=1)
+
+        # A teacher-forced pass without a cache has no compiled graph, so it runs eagerly
+        hidden = self._eager_decoder()(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states.expand(rows, -1, -1),
+            encoder_attention_mask=attention_mask.expand(rows, -1),
+            use_cache=False,
+            return_dict=True,
+        ).last_hidden_state
+        if self.output_scale is not None:
+            hidden = hidden * self.output_scale
+        log_probs = torch.log_softmax(self.model.lm_head(hidden).float(), dim=-1)
+        token_log_probs = log_probs.gather(-1, labels[:, :, None]).squeeze(-1).masked_fill(~mask, 0.0)
+        return list(zip(token_log_probs.sum(dim=1).tolist(), mask.sum(dim=1).tolist()))
+
+    def lookup_stats(self):
+        """
+        Returns:
+            dict: Prompt lookup counters, the share of drafted tokens accepted, and tokens
+            generated per decoder forward (the reduction in forwards over plain greedy decoding)
+        """
+        with self._lookup_lock:
+            counts = dict(self._lookup_counts)
+        counts["acceptance_rate"] = round(counts["accepted"] / counts["drafted"], 4) if counts["drafted"] else 0.0
+        counts["tokens_per_forward"] = round(counts["tokens"] / counts["forwards"], 2) if counts["forwards"] else 0.0
+        return counts
+
+    def _beam_search(self, encoder_hidden_states, encoder_attention_mask, options, processors, stopping_criteria):
+        """
+        Beam search, following generate()'s scoring and stopping rules so both pick the same hypotheses.
+
+        Returns:
+            torch.Tensor: The best hypothesis for each input, starting with the decoder start token
+        """
+        batch_size = encoder_hidden_states.shape[0]
+        num_beams = options["num_beams"]
+        max_new_tokens = options["max_new_tokens"]
+        length_penalty = options["length_penalty"]
+        early_stopping = options["early_stopping"]
+        device = encoder_hidden_states.device
+        vocab_size = self.model.config.vocab_size
+
+        # Every beam attends over its own input's encoder output
+        rows = batch_size * num_beams
+        encoder_hidden_states = encoder_hidden_states.repeat_interleave(num_beams, dim=0)
+        encoder_attention_mask = encoder_attention_mask.repeat_interleave(num_beams, dim=0)
+        cache = self._new_cache(rows, max_new_tokens, encoder_hidden_states)
+
+        # Twice as many candidates as beams are kept each step, so enough of them
+        # continue even if the best ones all end with EOS
+        candidates = 2 * num_beams
+        top_beams = torch.arange(candidates, device=device) < num_beams
+        batch_offset = torch.arange(batch_size, device=device)[:, None] * num_beams
+
+        running = torch.full((batch_size, num_beams, max_new_tokens + 1), self.pad_token_id, dtype=torch.long, device=device)
+        running[:, :, 0] = self.decoder_start_token_id
+        finished = running.clone()
+        # Only the first beam is live at the start, so the beams don't all pick the same tokens
+        running_scores = torch.zeros((batch_size, num_beams), device=device)
+        running_scores[:, 1:] = -1e9
+        finished_scores = torch.full((batch_size, num_beams), -1e9, device=device)
+        is_finished = torch.zeros((batch_size, num_beams), dtype=torch.bool, device=device)
+
+        for position in range(max_new_tokens):
+            length = position + 1
+            flat_running = running[:, :, :length].reshape(rows, length)
+            logits = self.step(flat_running[:, -1], position, cache, encoder_hidden_states, encoder_attention_mask)
+            log_probs = processors(flat_running, torch.log_softmax(logits, dim=-1))
+            log_probs = (log_probs.view(batch_size, num_beams, vocab_size) + running_scores[:, :, None])
+            log_probs = log_probs.view(batch_size, num_beams * vocab_size)
+
+            # Best continuations over all of an input's beams
+            if options["do_sample"]:
+                top_indices = torch.multinomial(torch.softmax(log_probs, dim=-1), num_samples=candidates)
+                top_scores = torch.gather(log_probs, 1, top_indices)
+            else:
+                top_scores, top_indices = torch.topk(log_probs, candidates)
+            top_parents = top_indices // vocab_size
+            top_sequences = torch.gather(running, 1, top_parents[:, :, None].expand(-1, -1, running.shape[-1])).clone()
+            top_sequences[:, :, length] = top_indices % vocab_size
+
+            hits = (top_sequences[:, :, length] == self.eos_token_id) | (length == max_new_tokens)
+            if stopping_criteria:
+                hits |= stopping_criteria(top_sequences[:, :, :length + 1].reshape(batch_size * candidates, -1), None) \
+                    .view(batch_size, candidates)
+
+            # Continue with the best candidates that haven't finished
+            live_scores = top_scores + hits.float() * -1e9
+            next_beams = torch.topk(live_scores, num_beams)[1]
+            running = torch.gather(top_sequences, 1, next_beams[:, :, None].expand(-1, -1, running.shape[-1]))
+            running_scores = torch.gather(live_scores, 1, next_beams)
+            parents = torch.gather(top_parents, 1, next_beams)
+
+            # Keep the best finished hypotheses, scored with the length penalty
+            just_finished = hits & top_beams[None, :]
+            done_scores = top_scores / (length ** length_penalty)
+            if early_stopping is True:
+                done_scores += is_finished.all(dim=-1, keepdim=True).float() * -1e9
+            done_scores += (~just_finished).float() * -1e9
+            merged_scores = torch.cat([finished_scores, done_scores], dim=1)
+            best = torch.topk(merged_scores, num_beams)[1]
+            finished = torch.gather(torch.cat([finished, top_sequences], dim=1), 1, best[:, :, None].expand(-1, -1, running.shape[-1]))
+            finished_scores = torch.gather(merged_scores, 1, best)
+            is_finished = torch.gather(torch.cat([is_finished, just_finished], dim=1), 1, best)
+
+            # The cache follows the beams to their new positions
+            cache.self_attention_cache.reorder_cache((parents + batch_offset).view(-1))
+
+            # Stop once no running beam can beat the finished ones (or nothing can continue)
+            if early_stopping == "never" and length_penalty > 0.0:
+                best_length = max_new_tokens
+            else:
+                best_length = length
+            best_running = running_scores[:, :1] / (best_length ** length_penalty)
+            worst_finished = torch.where(is_finished, finished_scores.min(dim=1, keepdim=True)[0], -1e9)
+            can_improve = (best_running > worst_finished).any()
+            open_beams = not (early_stopping is True and bool(is_finished.all()))
+            if not (can_improve and open_beams and not bool(hits.all())):
+                break
+
+        return finished[:, 0]
+
+    def encode(self, texts):
+        """
+        Tokenize prompts into a right-padded batch.
+
+        Padding is done here rather than by the tokenizer, as the pipeline does: asking
+        a fast tokenizer to pad reconfigures it, which fails while another thread
+        (e.g. the micro-batcher measuring prompt lengths) is using it.
+
+        Args:
+            texts (list): The prompts
+
+        Returns:
+            tuple: (input_ids, attention_mask) tensors
+        """
+        ids = self.tokenizer(texts, return_token_type_ids=False)["input_ids"]
+        length = max(len(row) for row in ids)
+        input_ids = torch.full((len(ids), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), length), dtype=torch.long)
+        for i, row in enumerate(ids):
+            input_ids[i, :len(row)] = torch.tensor(row)
+            attention_mask[i, :len(row)] = 1
+        return input_ids.to(self.model.device), attention_mask.to(self.model.device)
+
+    @torch.no_grad()
+    def generate(self, input_ids, attention_mask=None, stopping_criteria=None, **generate_kwargs):
+        """
+        Generate output ids for a tokenized batch, as model.generate() does.
+
+        Args:
+            input_ids (torch.Tensor): Padded prompt token ids
+            attention_mask (torch.Tensor): Padding mask for input_ids
+            stopping_criteria (StoppingCriteriaList): Extra criteria, e.g. deadlines,
+                called with every running sequence after each step
+            **generate_kwargs: Generation parameters, as for the pipeline
+
+        Returns:
+            torch.Tensor: One row of generated ids per prompt, starting with the decoder start token
+        """
+        options = self.options(generate_kwargs)
+        processors = self.processors(options)
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        encoder_hidden_states = self.model.encoder(
+            input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+        ).last_hidden_state
+
+        # Prompt lookup needs the draft checked against a single sequence's greedy choices
+        if self.lookup_tokens and input_ids.shape[0] == 1 and options["num_beams"] == 1 and not options["do_sample"]:
+            prompt = input_ids[0, :int(attention_mask[0].sum())].tolist()
+            return self._lookup_search(prompt, encoder_hidden_states, attention_mask, options, processors, stopping_criteria)
+
+        search = self._beam_search if options["num_beams"] > 1 else self._search
+        return search(encoder_hidden_states, attention_mask, options, processors, stopping_criteria)
+
+    def __call__(self, inputs, batch_size=None, stopping_criteria=None, **generate_kwargs):
+        """
+        Generate text for one prompt or a list of prompts.
+
+        Args:
+            inputs (str or list): The prompt(s)
+            batch_size (int): Maximum number of prompts decoded together
+            stopping_criteria (StoppingCriteriaList): Extra stopping criteria, e.g. deadlines
+            **generate_kwargs: Generation parameters, as for the pipeline
+
+        Returns:
+            list: One {"generated_text": ...} dict per prompt
+        """
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        batch_size = batch_size or len(texts)
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            input_ids, attention_mask = self.encode(texts[start:start + batch_size])
+            sequences = self.generate(
+                input_ids, attention_mask, stopping_criteria=stopping_criteria, **generate_kwargs
+            )
+            outputs.extend(
+                {"generated_text": text}
+                for text in self.tokenizer.batch_decode(sequences, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+            )
+        return outputs
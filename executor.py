@@ -0,0 +1,87 @@
+"""
+Bounded executor for model calls.
+
+Every model call runs on one of a fixed number of worker threads, and
+PyTorch's intra-op thread count is divided between those workers so the
+total number of busy threads never exceeds the CPU budget. Requests that
+arrive while all workers are busy wait in a queue instead of competing
+for cores.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class InferenceExecutor:
+    """
+    Runs model calls on a fixed number of worker threads.
+
+    Args:
+        workers (int): Number of model calls allowed to run at the same time
+        total_threads (int): CPU threads available to PyTorch across all workers.
+            Defaults to the number of CPUs
+    """
+
+    def __init__(self, workers=1, total_threads=None):
+        self.workers = max(1, int(workers))
+        total_threads = int(total_threads or os.cpu_count() or 1)
+        self.threads_per_worker = max(1, total_threads // self.workers)
+
+        # Apply the budget to the main thread as well as to each worker,
+        # since PyTorch may track the intra-op setting per calling thread
+        torch.set_num_threads(self.threads_per_worker)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="inference",
+            initializer=torch.set_num_threads,
+            initargs=(self.threads_per_worker,),
+        )
+
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a model call.
+
+        Args:
+            fn (callable): The function to run on a worker thread
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            Future: Resolves to the return value of fn
+        """
+        with self._lock:
+            self._queued += 1
+        return self._pool.submit(self._run, fn, args, kwargs)
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Worker and thread budget, plus queued, running and completed call counts
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+            }
@@ -0,0 +1,25 @@
+"""
+Dynamic int8 quantization for CPU inference.
+
+Dynamic quantization stores the weights of every Linear layer as int8 and
+quantizes activations on the fly, which makes the matrix multiplications
+that dominate T5 inference considerably faster on CPU and shrinks the
+model in memory. Outputs can differ slightly from fp32, so
+benchmarks/quantization_report.py compares the two before it is enabled.
+"""
+
+import torch
+
+
+def quantize_dynamic_int8(model):
+    """
+    Quantize a model's Linear layers to int8 for CPU inference.
+
+    Args:
+        model (torch.nn.Module): The fp32 model; it is modified in place
+
+    Returns:
+        torch.nn.Module: The quantized model
+    """
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
@@ -0,0 +1,109 @@
+"""
+Semantic response cache for paraphrased prompts.
+
+The exact-match response cache only helps when a prompt is sent again
+character for character. Prompts that are worded differently but ask the
+same thing ("How old are you?" / "What is your age?") have very similar
+encoder embeddings, so this cache keeps the embedding of every generated
+prompt next to its output and answers a new prompt with the output of the
+most similar cached one, if their cosine similarity reaches a threshold.
+
+The index is a flat NumPy matrix of unit-length embeddings, searched
+exhaustively with one matrix-vector product, which is exact and fast
+enough for tens of thousands of entries. Outputs are only reused between
+requests with the same generation parameters. When full, the oldest
+entries are overwritten first.
+"""
+
+import threading
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Thread-safe cache of outputs keyed by prompt embedding and generation parameters.
+
+    Args:
+        threshold (float): Minimum cosine similarity between a prompt and a cached
+            prompt for the cached output to be reused
+        max_entries (int): Maximum number of cached outputs
+    """
+
+    def __init__(self, threshold=0.95, max_entries=10000):
+        self.threshold = float(threshold)
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        # Allocated on the first put, once the embedding size is known
+        self._vectors = None
+        self._groups = np.full(self.max_entries, -1, dtype=np.int64)
+        self._outputs = [None] * self.max_entries
+        self._group_ids = {}
+        self._size = 0
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, vector, params):
+        """
+        Find the output of the most similar cached prompt.
+
+        Args:
+            vector (list): Unit-length embedding of the prompt
+            params (tuple): Generation parameters, as in cache_key()
+
+        Returns:
+            str: The cached output, or None if no cached prompt with the same
+            parameters is similar enough
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            group = self._group_ids.get(params)
+            if group is None or self._vectors is None:
+                self.misses += 1
+                return None
+            similarities = self._vectors[:self._size] @ query
+            similarities[self._groups[:self._size] != group] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._outputs[best]
+
+    def put(self, vector, params, output):
+        """
+        Store an output, overwriting the oldest entry once the cache is full.
+
+        Args:
+            vector (list): Unit-length embedding of the prompt
+            params (tuple): Generation parameters, as in cache_key()
+            output (str): The generated output
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if self._size == self.max_entries:
+                self.evictions += 1
+            slot = self._next
+            self._vectors[slot] = vector
+            self._groups[slot] = self._group_ids.setdefault(params, len(self._group_ids))
+            self._outputs[slot] = output
+            self._next = (slot + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count, the similarity threshold, and hit/miss/eviction counters
+        """
+        with self._lock:
+            return {
+                "entries": self._size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
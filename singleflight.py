@@ -0,0 +1,61 @@
+"""
+Coalescing of identical in-flight requests.
+
+When the same prompt with the same parameters arrives several times while
+the first one is still being generated, the later requests wait on the
+first request's result instead of running the model again.
+"""
+
+import threading
+
+
+class SingleFlight:
+    """
+    Shares one pending result between identical concurrent calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.collapsed = 0
+
+    def do(self, key, start, context=None):
+        """
+        Join the in-flight call for a key, or start a new one.
+
+        Args:
+            key (tuple): Identifies identical calls
+            start (callable): Starts the work and returns a Future; only called
+                when no call with this key is in flight
+            context (object): Extra state shared with callers that join this call,
+                e.g. its deadline
+
+        Returns:
+            tuple: (Future, context, bool) - the shared future, the context of the
+            call that started it, and whether this caller started it
+        """
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None:
+                self.collapsed += 1
+                return flight[0], flight[1], False
+            future = start()
+            self._in_flight[key] = (future, context)
+
+        # Forget the call once it finishes so later requests start fresh
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future, context, True
+
+    def _forget(self, key, future):
+        with self._lock:
+            flight = self._in_flight.get(key)
+            if flight is not None and flight[0] is future:
+                del self._in_flight[key]
+
+    def stats(self):
+        """
+        Returns:
+            dict: Number of distinct calls in flight and how many requests were collapsed into them
+        """
+        with self._lock:
+            return {"in_flight": len(self._in_flight), "collapsed": self.collapsed}
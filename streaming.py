@@ -0,0 +1,89 @@
+"""
+Token streaming over Server-Sent Events.
+
+The model generates on an inference worker while a TextIteratorStreamer
+hands decoded text back as soon as each token is produced. Each piece is
+sent to the client as an SSE event, followed by a final event with the
+full output and server-side timings (time to first token and total).
+"""
+
+import json
+import time
+
+from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+from deadlines import DeadlineCriteria
+
+
+def sse_event(event, data):
+    """
+    Format one Server-Sent Event.
+
+    Args:
+        event (str): Event name
+        data (dict): Payload, sent as JSON
+
+    Returns:
+        str: The encoded event
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_generate(model, tokenizer, executor, text, deadline=None, **generate_kwargs):
+    """
+    Generate text for a prompt and yield it incrementally as SSE events.
+
+    Args:
+        model: The seq2seq model behind the pipeline
+        tokenizer: The model's tokenizer
+        executor (InferenceExecutor): Executor the generation runs on
+        text (str): The input prompt
+        deadline (Deadline): Optional deadline; generation stops once it expires,
+            and the deadline is cancelled if the client stops reading early
+        **generate_kwargs: Extra arguments for model.generate
+
+    Yields:
+        str: "token" events carrying new text, then a "done" event with the
+        full output, or an "error" event if generation failed or timed out
+    """
+    start = time.perf_counter()
+    streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+    inputs = tokenizer(text, return_tensors="pt", return_token_type_ids=False)
+    if deadline is not None:
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList([DeadlineCriteria([deadline])])
+    future = executor.submit(model.generate, **inputs, streamer=streamer, **generate_kwargs)
+
+    # If generation fails before finishing, unblock the streamer so the loop below ends
+    future.add_done_callback(lambda f: f.exception() and streamer.on_finalized_text("", stream_end=True))
+
+    first_token_ms = None
+    pieces = []
+    finished = False
+    try:
+        for piece in streamer:
+            if not piece:
+                continue
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - start) * 1000
+            pieces.append(piece)
+            yield sse_event("token", {"text": piece})
+        finished = True
+    finally:
+        # The client stopped reading before the end, so stop generating for it
+        if not finished and deadline is not None:
+            deadline.cancel()
+
+    error = future.exception()
+    if error is not None:
+        yield sse_event("error", {"detail": str(error)})
+        return
+
+    if deadline is not None and deadline.expired():
+        yield sse_event("error", {"detail": "Request deadline exceeded"})
+        return
+
+    yield sse_event("done", {
+        "output": "".join(pieces),
+        "time_to_first_token_ms": round(first_token_ms or 0.0, 2),
+        "total_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
@@ -0,0 +1,58 @@
+# The app's modules live at the repository root, not in a package
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = [f"w{index}" for index in range(96)]
+
+
+@pytest.fixture(scope="session")
+def words():
+    return WORDS
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    # A word-level tokenizer over WORDS that ends every input with </s>, as T5's does.
+    # Imported here so tests that don't need a tokenizer run without the model libraries
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"<pad>": 0, "</s>": 1, "<unk>": 2, **{word: index + 3 for index, word in enumerate(WORDS)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    backend.post_processor = processors.TemplateProcessing(single="$A </s>", special_tokens=[("</s>", 1)])
+    return PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="</s>", unk_token="<unk>")
+
+
+@pytest.fixture(scope="session")
+def model(tokenizer):
+    # A small randomly initialized T5; tests that swap parts of it must put them back
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration
+
+    torch.manual_seed(0)
+    config = T5Config(
+        vocab_size=len(tokenizer), d_model=32, d_kv=8, d_ff=64, num_layers=2, num_decoder_layers=2,
+        num_heads=4, pad_token_id=0, eos_token_id=1, decoder_start_token_id=0,
+    )
+    return T5ForConditionalGeneration(config).eval()
+
+
+@pytest.fixture(scope="session")
+def app(tokenizer, model, tmp_path_factory):
+    # The app module, serving the small T5 from a local directory; it is configured at import time
+    import importlib
+
+    pytest.importorskip("httpx", reason="fastapi.testclient needs httpx")
+    path = tmp_path_factory.mktemp("model")
+    tokenizer.save_pretrained(path)
+    model.save_pretrained(path)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("MODEL_ID", str(path))
+        patch.setenv("CACHE_DB_PATH", "")
+        patch.setenv("SEMANTIC_CACHE_THRESHOLD", "0")
+        return importlib.import_module("app")
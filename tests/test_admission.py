@@ -0,0 +1,64 @@
+"""
+Tests for admission control: work held without a Future is released exactly
+once, however many of the places its work can end call release, and bulk
+requests are capped so they still fit next to other work.
+
+Run with: python -m pytest tests
+"""
+
+import gc
+import weakref
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def test_hold_releases_once():
+    admission = AdmissionController(max_depth=2)
+    release = admission.hold()
+    admission.hold()
+    with pytest.raises(Overloaded):
+        admission.admit()
+
+    release()
+    release()
+    assert admission.stats()["outstanding"] == 1
+
+
+def test_hold_released_by_finalizer_when_stream_never_starts():
+    admission = AdmissionController(max_depth=2)
+    release = admission.hold()
+
+    def events():
+        try:
+            yield "event"
+        finally:
+            release()
+
+    # A generator that is never iterated doesn't run its finally, so only the finalizer releases it
+    stream = events()
+    weakref.finalize(stream, release)
+    del stream
+    gc.collect()
+    assert admission.stats()["outstanding"] == 0
+
+
+def test_bulk_request_is_capped_and_fits_next_to_other_work():
+    admission = AdmissionController(max_depth=64)
+    admission.admit()
+    # 1024 prompts in chunks of 16 would be 64 units, the whole queue
+    admitted_at = admission.admit(64)
+    assert admission.stats()["outstanding"] == 1 + admission.max_request_units == 33
+
+    admission.release(admitted_at, 64)
+    assert admission.stats()["outstanding"] == 1
+
+
+def test_bulk_request_rejected_when_queue_is_deep():
+    admission = AdmissionController(max_depth=64, max_queue_wait_ms=0)
+    for _ in range(40):
+        admission.admit()
+    with pytest.raises(Overloaded):
+        admission.admit(1000)
+    assert admission.stats()["outstanding"] == 40
@@ -0,0 +1,59 @@
+"""
+Tests for chunking: what split_instruction takes for an instruction, and that
+chunk_text keeps within its token budget and overlaps consecutive chunks.
+
+Run with: python -m pytest tests
+"""
+
+import pytest
+
+from chunking import chunk_text, split_instruction
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Summarize: a long text", ("Summarize:", "a long text")),
+    ("Translate English to German: The house is small.", ("Translate English to German:", "The house is small.")),
+    ("summarize:\nthe text", ("summarize:", "the text")),
+    # Only the first colon ends the instruction
+    ("Answer the question: what is it? Context: a box", ("Answer the question:", "what is it? Context: a box")),
+])
+def test_split_instruction(text, expected):
+    assert split_instruction(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Meeting at 10:30 in room 4: bring notes",
+    "See http://example.com: it has the details",
+    "Note, the plan changed. Step one: do it",
+    "Q: why",
+    "no instruction here",
+])
+def test_split_instruction_ignores_times_urls_and_sentences(text):
+    assert split_instruction(text) == ("", text)
+
+
+def test_split_instruction_word_limit():
+    eight = "Read this text and then tell me everything:"
+    assert split_instruction(f"{eight} body") == (eight, "body")
+    assert split_instruction(f"Please {eight.lower()} body") == ("", f"Please {eight.lower()} body")
+    assert split_instruction(f"Please {eight.lower()} body", max_words=9)[0] == f"Please {eight.lower()}"
+
+
+def test_chunk_text_fits(tokenizer, words):
+    # One token per word, with offsets into the text since the tokenizer is a fast one
+    text = " ".join(words[:10])
+    assert chunk_text(tokenizer, text, 10, 3) == [text]
+
+
+@pytest.mark.parametrize("chunk_tokens, overlap_tokens", [(10, 0), (10, 3), (7, 6), (4, 9)])
+def test_chunk_text_budget_and_overlap(tokenizer, words, chunk_tokens, overlap_tokens):
+    words = words[:50]
+    chunks = [chunk.split() for chunk in chunk_text(tokenizer, "  ".join(words), chunk_tokens, overlap_tokens)]
+    overlap = min(overlap_tokens, chunk_tokens - 1)
+    assert all(len(chunk) <= chunk_tokens for chunk in chunks)
+    assert chunks[0][0] == words[0] and chunks[-1][-1] == words[-1]
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each chunk starts with the last tokens of the one before and continues where it stopped
+        assert len(previous) == chunk_tokens
+        assert chunk[:overlap] == previous[len(previous) - overlap:]
+        assert words.index(chunk[overlap]) == words.index(previous[-1]) + 1
@@ -0,0 +1,74 @@
+"""
+Regression tests: generating through EncoderCache must produce exactly the
+output of the bare encoder, and the cache must stay within its byte bound.
+
+EncoderCache replaces model.encoder on every generation path (the pipeline,
+the lean engine, candidates, scoring and embeddings), so a change that breaks
+reusing hidden states fails here instead of silently changing outputs.
+
+Run with: python -m pytest tests
+"""
+
+import pytest
+import torch
+
+from encoder_cache import EncoderCache
+
+PROMPTS = [
+    "w1 w2 w3 w4 w5",
+    "w7 w7 w8",
+    "w10 w11 w12 w13 w14 w15 w16 w17 w18 w19 w20",
+    "w30",
+]
+
+
+def generate(model, tokenizer, texts, **generate_kwargs):
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, return_token_type_ids=False)
+    with torch.no_grad():
+        sequences = model.generate(**inputs, **generate_kwargs)
+    return tokenizer.batch_decode(sequences, skip_special_tokens=True)
+
+
+@pytest.mark.parametrize("generate_kwargs", [{}, {"num_beams": 3}])
+def test_cache_matches_encoder(model, tokenizer, monkeypatch, generate_kwargs):
+    generate_kwargs = dict(generate_kwargs, max_new_tokens=12)
+    expected = generate(model, tokenizer, PROMPTS, **generate_kwargs)
+
+    cache = EncoderCache(model.encoder)
+    monkeypatch.setattr(model, "encoder", cache)
+    # The first call fills the cache and the second is answered from it
+    assert generate(model, tokenizer, PROMPTS, **generate_kwargs) == expected
+    assert generate(model, tokenizer, PROMPTS, **generate_kwargs) == expected
+    assert (cache.hits, cache.misses) == (len(PROMPTS), len(PROMPTS))
+
+
+def test_cache_reused_with_other_parameters(model, tokenizer, monkeypatch):
+    expected = generate(model, tokenizer, PROMPTS, num_beams=3, max_new_tokens=12)
+
+    cache = EncoderCache(model.encoder)
+    monkeypatch.setattr(model, "encoder", cache)
+    generate(model, tokenizer, PROMPTS, max_new_tokens=12)
+    assert generate(model, tokenizer, PROMPTS, num_beams=3, max_new_tokens=12) == expected
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_cache_evicts_least_recently_used(model, tokenizer):
+    # Room for two entries of three words and </s>
+    entry = 4 * model.config.d_model * 4 + 4 * 8
+    cache = EncoderCache(model.encoder, max_bytes=2 * entry)
+
+    def encode(text):
+        inputs = tokenizer([text], return_tensors="pt", return_token_type_ids=False)
+        with torch.no_grad():
+            return cache(**inputs).last_hidden_state, model.encoder(**inputs).last_hidden_state
+
+    for text in ["w1 w2 w3", "w4 w5 w6", "w1 w2 w3", "w7 w8 w9"]:
+        encode(text)
+    # "w4 w5 w6" was used least recently, so it made room for "w7 w8 w9"
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 2 * entry
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+
+    hidden, expected = encode("w1 w2 w3")
+    assert torch.equal(hidden, expected)
+    encode("w4 w5 w6")
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
@@ -0,0 +1,114 @@
+"""
+Regression tests: the lean engine's decoding loops must produce exactly the
+output of transformers' generate().
+
+GenerationEngine reimplements greedy decoding, beam search and prompt lookup,
+and ContinuousBatcher decodes through the engine's steps, all on the promise
+that outputs don't change. These tests compare them with model.generate() on a
+small randomly initialized T5, so an upgrade of transformers or a change to the
+engine that breaks the promise fails here instead of silently changing outputs.
+ContinuousBatcher must also keep serving after a failed step.
+
+Run with: python -m pytest tests
+"""
+
+import pytest
+import torch
+
+from continuous import ContinuousBatcher
+from engine import GenerationEngine
+
+PROMPTS = [
+    "w1 w2 w3 w4 w5",
+    "w7 w7 w8",
+    "w10 w11 w12 w13 w14 w15 w16 w17 w18 w19 w20",
+    "w30",
+]
+
+CASES = [
+    {},
+    {"num_beams": 3},
+    {"num_beams": 2, "length_penalty": 0.5},
+    {"num_beams": 4, "early_stopping": True},
+    {"num_beams": 3, "early_stopping": False, "length_penalty": 2.0},
+    {"repetition_penalty": 1.5},
+    {"no_repeat_ngram_size": 2},
+    {"min_new_tokens": 6},
+    {"num_beams": 2, "repetition_penalty": 1.3, "no_repeat_ngram_size": 2, "min_new_tokens": 3},
+]
+
+
+def reference(model, tokenizer, texts, **generate_kwargs):
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, return_token_type_ids=False)
+    with torch.no_grad():
+        sequences = model.generate(**inputs, **generate_kwargs)
+    return tokenizer.batch_decode(sequences, skip_special_tokens=True)
+
+
+@pytest.mark.parametrize("generate_kwargs", CASES)
+def test_engine_matches_generate(model, tokenizer, generate_kwargs):
+    engine = GenerationEngine(model, tokenizer)
+    generate_kwargs = dict(generate_kwargs, max_new_tokens=12)
+    outputs = [output["generated_text"] for output in engine(PROMPTS, **generate_kwargs)]
+    assert outputs == reference(model, tokenizer, PROMPTS, **generate_kwargs)
+
+
+@pytest.mark.parametrize("generate_kwargs", [case for case in CASES if "num_beams" not in case])
+def test_prompt_lookup_matches_generate(model, tokenizer, generate_kwargs):
+    engine = GenerationEngine(model, tokenizer, lookup_tokens=4, lookup_ngram=2)
+    generate_kwargs = dict(generate_kwargs, max_new_tokens=16)
+    for text in PROMPTS:
+        assert engine(text, **generate_kwargs)[0]["generated_text"] == reference(model, tokenizer, [text], **generate_kwargs)[0]
+
+
+def test_continuous_batching_matches_generate(model, tokenizer):
+    engine = GenerationEngine(model, tokenizer)
+
+    def run_batch(texts, deadlines=None, **generate_kwargs):
+        return [output["generated_text"] for output in engine(texts, **generate_kwargs)]
+
+    batcher = ContinuousBatcher(engine, run_batch, max_active=3)
+    # Different lengths and parameters, so sequences join and leave the running batch at different steps
+    requests = [
+        (text, dict(case, max_new_tokens=max_new_tokens))
+        for text, max_new_tokens in zip(PROMPTS, (7, 16, 9, 12))
+        for case in CASES
+    ]
+    futures = [batcher.submit(text, **generate_kwargs) for text, generate_kwargs in requests]
+    for (text, generate_kwargs), future in zip(requests, futures):
+        assert future.result(timeout=60) == reference(model, tokenizer, [text], **generate_kwargs)[0]
+
+
+def test_choose_runs_without_autograd(model, tokenizer, monkeypatch):
+    engine = GenerationEngine(model, tokenizer)
+    logits = []
+    decode = engine.decode
+    monkeypatch.setattr(engine, "decode", lambda *args, **kwargs: logits.append(decode(*args, **kwargs)) or logits[-1])
+    assert engine.choose("w1 w2 w3", ["w4 w5", "w4 w6", "w7"]) in ("w4 w5", "w4 w6", "w7")
+    assert logits and not any(step.requires_grad for step in logits)
+
+
+def test_continuous_batching_recovers_from_failed_step(model, tokenizer, monkeypatch):
+    engine = GenerationEngine(model, tokenizer)
+
+    def run_batch(texts, deadlines=None, **generate_kwargs):
+        return [output["generated_text"] for output in engine(texts, **generate_kwargs)]
+
+    batcher = ContinuousBatcher(engine, run_batch, max_active=3)
+    decode = tokenizer.decode
+    failures = [RuntimeError("decode failed")]
+
+    def failing_decode(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(tokenizer, "decode", failing_decode)
+
+    # The first finished sequence fails its decode, which fails every sequence in the batch
+    futures = [batcher.submit(text, max_new_tokens=max_new_tokens) for text, max_new_tokens in zip(PROMPTS, (3, 8))]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="decode failed"):
+            future.result(timeout=60)
+    # The scheduler is still running and starts from an empty batch
+    assert batcher.submit(PROMPTS[2], max_new_tokens=5).result(timeout=60) == reference(model, tokenizer, [PROMPTS[2]], max_new_tokens=5)[0]
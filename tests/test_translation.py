@@ -0,0 +1,87 @@
+"""
+Tests for translation's sentence splitting: abbreviations and initials don't
+end sentences, and line and paragraph breaks survive the round trip; and for
+when /generate translates a text one sentence per prompt.
+
+Run with: python -m pytest tests
+"""
+
+import pytest
+
+from translation import has_paragraphs, is_translation, join_sentences, split_sentences
+
+TEXT = (
+    "Hello there. How are you?  Dr. Smith, e.g. J. R. R. Tolkien said so. "
+    "Mr. X arrived at 5 p.m. today.\nNext line! End.\n\nPara two."
+)
+
+
+@pytest.mark.parametrize("instruction, expected", [
+    ("Translate to French:", True),
+    ("Translate English to German:", True),
+    ("translate from en to de:", True),
+    ("Translate:", False),
+    ("Summarize:", False),
+])
+def test_is_translation(instruction, expected):
+    assert is_translation(instruction) is expected
+
+
+def test_split_sentences_abbreviations_and_initials():
+    sentences, separators = split_sentences(TEXT)
+    assert sentences == [
+        "Hello there.",
+        "How are you?",
+        "Dr. Smith, e.g. J. R. R. Tolkien said so.",
+        "Mr. X arrived at 5 p.m. today.",
+        "Next line!",
+        "End.",
+        "Para two.",
+    ]
+    assert separators == [" ", "  ", " ", "\n", " ", "\n\n", ""]
+
+
+def test_split_sentences_abbreviation_at_line_end():
+    # A line break ends the sentence even after an abbreviation
+    assert split_sentences("Ask the Dr.\nShe knows.")[0] == ["Ask the Dr.", "She knows."]
+
+
+def test_has_paragraphs():
+    assert has_paragraphs(split_sentences(TEXT)[1])
+    assert not has_paragraphs(split_sentences("Hello. How are you?\nFine.")[1])
+    # A blank line after the last sentence is not a paragraph break
+    assert not has_paragraphs(split_sentences("Hello. How are you?\n\n")[1])
+
+
+def test_join_sentences_round_trip():
+    text = "First line. Second sentence.\nNew line.\n\nNew paragraph!\n\n\nAfter two blank lines."
+    assert join_sentences(*split_sentences(text)) == text
+    # Extra spaces between sentences become one; surrounding whitespace is dropped
+    assert join_sentences(*split_sentences("  One.   Two.\n\nThree.  ")) == "One. Two.\n\nThree."
+    assert join_sentences(["Eins. ", " Zwei."], [" \n\n ", ""]) == "Eins.\n\nZwei."
+
+
+def test_split_translation_ignores_one_pass_output(app, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    calls = []
+
+    def run_batch(texts, deadlines=None, **generate_kwargs):
+        calls.append(list(texts))
+        return [f"out{len(calls)}"] * len(texts)
+
+    monkeypatch.setattr(app, "run_pipeline_batch", run_batch)
+    monkeypatch.setattr(app.batcher, "run_batch", run_batch)
+    client = TestClient(app.app)
+    text = "Translate to German: w1 w2.\n\nw3 w4. w5."
+
+    assert client.get("/generate", params={"text": text, "split_sentences": "false"}).json() == {"output": "out1"}
+    assert calls == [[text]]
+    # The one-pass output cached above is not the answer to a split translation
+    assert client.get("/generate", params={"text": text}).json() == {"output": "out2\n\nout2 out2"}
+    # Prompts run sorted by length, so only their set is fixed
+    assert len(calls) == 2
+    assert sorted(calls[1]) == ["Translate to German: w1 w2.", "Translate to German: w3 w4.", "Translate to German: w5."]
+    # The joined output is cached under its own key
+    assert client.get("/generate", params={"text": text}).json() == {"output": "out2\n\nout2 out2"}
+    assert len(calls) == 2
@@ -0,0 +1,100 @@
+"""
+Sentence-parallel translation of long texts.
+
+Translating several paragraphs in one prompt means one long sequential
+decode, and past the model's input length the end of the text is lost.
+Sentences translate independently well enough, so a "Translate to X:"
+prompt over a long or multi-paragraph text is split into its sentences, every sentence is
+translated as its own prompt in one padded batch, and the translations
+are put back together in order, keeping the original line and paragraph
+breaks. Many short decodes run side by side instead of one long one.
+
+Sentences end at ".", "!", "?" or "…" followed by whitespace, and at line
+breaks, except after common abbreviations ("Dr.", "e.g.") and initials.
+"""
+
+import re
+
+# "Translate to German:", "Translate English to French:", "translate from en to de:"
+TRANSLATION_INSTRUCTION = re.compile(r"translate\b[^:\n]*\bto\b[^:\n]*:", re.IGNORECASE)
+
+# A sentence up to its end punctuation (with closing quotes and brackets) or the end
+# of its line, followed by the whitespace that separates it from the next one
+SENTENCE = re.compile(r"(\S.*?(?:[.!?…]+[\"'”’)\]]*(?=\s|$)|(?=\n)|$))(\s*)", re.DOTALL)
+
+# Words whose period doesn't end a sentence, besides initials like "J." or "e.g."
+ABBREVIATIONS = {
+    "mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "jr.", "sr.", "vs.", "no.", "fig.",
+    "approx.", "inc.", "ltd.", "co.", "cf.", "dept.", "est.", "gen.", "gov.", "mt.",
+}
+INITIALS = re.compile(r"(?:[A-Za-z]\.)+")
+
+
+def is_translation(instruction):
+    """
+    Check whether a prompt's instruction asks for a translation.
+
+    Args:
+        instruction (str): The instruction, as returned by chunking.split_instruction
+
+    Returns:
+        bool: True for instructions like "Translate to German:"
+    """
+    return TRANSLATION_INSTRUCTION.fullmatch(instruction.strip()) is not None
+
+
+def split_sentences(text):
+    """
+    Split text into sentences, keeping what separates them.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        tuple: (the sentences, the whitespace following each one)
+    """
+    sentences, separators = [], []
+    for match in SENTENCE.finditer(text):
+        # A period after an abbreviation on the same line continues the sentence
+        if sentences and "\n" not in separators[-1] and _abbreviated(sentences[-1]):
+            sentences[-1] += separators[-1] + match.group(1)
+            separators[-1] = match.group(2)
+            continue
+        sentences.append(match.group(1))
+        separators.append(match.group(2))
+    return sentences, separators
+
+
+def _abbreviated(sentence):
+    """Whether a sentence only seems to end, because its last word is an abbreviation or initial."""
+    word = sentence.rsplit(None, 1)[-1]
+    return word.lower() in ABBREVIATIONS or INITIALS.fullmatch(word) is not None
+
+
+def has_paragraphs(separators):
+    """
+    Args:
+        separators (list): The whitespace following each sentence, from split_sentences()
+
+    Returns:
+        bool: Whether the text has a blank line between two of its sentences
+    """
+    return any(separator.count("\n") >= 2 for separator in separators[:-1])
+
+
+def join_sentences(sentences, separators):
+    """
+    Put translated sentences back together, with the original line and paragraph breaks.
+
+    Args:
+        sentences (list): The translated sentences, in order
+        separators (list): The whitespace that followed each original sentence
+
+    Returns:
+        str: The joined text
+    """
+    parts = []
+    for sentence, separator in zip(sentences, separators):
+        # Breaks are kept as they were; spaces between sentences become a single space
+        parts.append(sentence.strip() + ("\n" * separator.count("\n") or (" " if separator else "")))
+    return "".join(parts).strip()